@@ -4,6 +4,7 @@
 
 import os
 from dotenv import load_dotenv
+from utils.docstore import open_database
 
 load_dotenv()
 
@@ -25,6 +26,9 @@ BOT_TOKEN = os.getenv("BOT_TOKEN", "")
 # Database configuration
 MONGO_URI = os.getenv("MONGO_URI", "")
 DB_NAME = os.getenv("DB_NAME", "telegram_downloader")
+DB_ENGINE = os.getenv("DB_ENGINE", "mongo" if MONGO_URI else "sqlite").lower()  # mongo, sqlite or memory
+DB_PATH = os.getenv("DB_PATH", "bot_data.db")  # SQLite file for DB_ENGINE=sqlite
+MONGO_DB = open_database(DB_ENGINE, MONGO_URI, DB_NAME, DB_PATH)
 
 # User authentication & management
 OWNER_ID = list(map(int, os.getenv("OWNER_ID", "").split())) # list separated by space
@@ -48,3 +52,29 @@ YT_COOKIES = os.getenv("YT_COOKIES", YTUB_COOKIES)
 INSTA_COOKIES = os.getenv("INSTA_COOKIES", INST_COOKIES)
 FREEMIUM_LIMIT = int(os.getenv("FREEMIUM_LIMIT", "0"))
 PREMIUM_LIMIT = int(os.getenv("PREMIUM_LIMIT", "500"))
+
+# Batch pipeline: transfers kept in flight per running batch
+BATCH_DOWNLOADS = int(os.getenv("BATCH_DOWNLOADS", "3"))
+BATCH_UPLOADS = int(os.getenv("BATCH_UPLOADS", "2"))
+FLOOD_RETRIES = int(os.getenv("FLOOD_RETRIES", "5"))  # FloodWait retries per Telegram call
+STREAM_RELAY = os.getenv("STREAM_RELAY", "true").lower() == "true"  # relay media without writing it to disk
+RELAY_WINDOW = int(os.getenv("RELAY_WINDOW", "8"))  # 512 KB parts buffered per relayed file
+ACTIVE_USERS_FLUSH = int(os.getenv("ACTIVE_USERS_FLUSH", "5"))  # seconds between batch checkpoint writes
+CLIENT_POOL_SIZE = int(os.getenv("CLIENT_POOL_SIZE", "50"))  # started per-user bots / user clients kept each
+CLIENT_IDLE_TIMEOUT = int(os.getenv("CLIENT_IDLE_TIMEOUT", "900"))  # seconds before an unused client is stopped
+MAX_DOWNLOADS = int(os.getenv("MAX_DOWNLOADS", "8"))  # downloads running at once across all users
+MAX_UPLOADS = int(os.getenv("MAX_UPLOADS", "6"))  # uploads running at once across all users
+PROGRESS_INTERVAL = float(os.getenv("PROGRESS_INTERVAL", "5"))  # min seconds between progress edits per chat
+DEDUPE_CACHE_SIZE = int(os.getenv("DEDUPE_CACHE_SIZE", "20000"))  # remembered uploads, reused instead of re-transferring
+CACHE_FLUSH_INTERVAL = int(os.getenv("CACHE_FLUSH_INTERVAL", "10"))  # min seconds between writes of the dedupe and peer caches
+DOWNLOAD_CONNECTIONS = int(os.getenv("DOWNLOAD_CONNECTIONS", "4"))  # parallel media sessions per large download
+PLAN_TTL = int(os.getenv("PLAN_TTL", "1800"))  # seconds a /scan result stays reusable by /batch
+PLAN_MAX_MESSAGES = int(os.getenv("PLAN_MAX_MESSAGES", "5000"))  # largest /scan range kept in memory for /batch to reuse
+MAX_QUEUED_JOBS = int(os.getenv("MAX_QUEUED_JOBS", "10"))  # /batch and /single jobs a user can queue behind the running one
+TRANSFER_RETRIES = int(os.getenv("TRANSFER_RETRIES", "4"))  # retries of a download/upload after transient errors
+RETRY_BASE_DELAY = float(os.getenv("RETRY_BASE_DELAY", "2"))  # seconds before the first retry, doubled each time
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "5000"))  # user documents kept in memory
+USER_CACHE_TTL = int(os.getenv("USER_CACHE_TTL", "600"))  # seconds before a cached user document is read again
+PROBE_WORKERS = int(os.getenv("PROBE_WORKERS", "4"))  # threads reading video metadata across all users
+FFMPEG_CONCURRENCY = int(os.getenv("FFMPEG_CONCURRENCY", "3"))  # ffmpeg processes running at once across all users
+FFMPEG_TIMEOUT = int(os.getenv("FFMPEG_TIMEOUT", "60"))  # seconds before a thumbnail/probe ffmpeg run is killed
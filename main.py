@@ -50,17 +50,7 @@ try:
             from shared_client import start_client
             logger.info("Successfully imported from adjusted path")
     
-    from config import BOT_TOKEN, API_ID, API_HASH, MONGO_DB
-    
-    # Verify in-memory database is initialized
-    logger.info("Verifying in-memory database...")
-    test_collection = MONGO_DB["test"]
-    test_collection.insert_one({"test": "connection"})
-    test_result = test_collection.find_one({"test": "connection"})
-    if test_result:
-        logger.info("In-memory database is working correctly")
-    else:
-        logger.warning("In-memory database test failed. Some features may not work correctly.")
+    from config import BOT_TOKEN, API_ID, API_HASH, MONGO_DB, DB_ENGINE
 except ImportError as e:
     logger.error(f"Import error: {e}")
     logger.error("Please check your configuration and ensure all dependencies are installed")
@@ -153,7 +143,22 @@ def setup_webhook():
         logger.error(f"Error setting up webhook: {e}")
         return False
 
+async def check_database():
+    logger.info(f"Verifying {DB_ENGINE} database...")
+    try:
+        test_collection = MONGO_DB["test"]
+        await test_collection.update_one({"_id": "startup"}, {"$set": {"test": "connection"}}, upsert=True)
+        if await test_collection.find_one({"_id": "startup"}):
+            logger.info(f"{DB_ENGINE} database is working correctly")
+        else:
+            logger.warning("Database test failed. Some features may not work correctly.")
+        await test_collection.delete_one({"_id": "startup"})
+    except Exception as e:
+        logger.error(f"Database test error: {e}")
+
 async def load_and_run_plugins():
+    await check_database()
+
     # Start the client and handle any potential errors
     try:
         logger.info("Attempting to start Telegram clients...")
@@ -2,45 +2,68 @@
 # Licensed under the GNU General Public License v3.0.  
 # See LICENSE file in the repository root for full license text.
 
-import os, re, time, asyncio
+import os, re, time, shlex, asyncio
+from datetime import datetime, timedelta
+from functools import partial
 from pyrogram import Client, filters
 from pyrogram.types import Message
-from pyrogram.errors import UserNotParticipant
+from pyrogram.errors import UserNotParticipant, PeerIdInvalid, ChannelPrivate
 from config import API_ID, API_HASH, LOG_GROUP, STRING, FORCE_SUB, FREEMIUM_LIMIT, PREMIUM_LIMIT
-from utils.func import get_user_data, screenshot, thumbnail, get_video_metadata
-from utils.func import get_user_data_key, process_text_with_rules, is_premium_user, E
+from config import BATCH_DOWNLOADS, BATCH_UPLOADS, STREAM_RELAY, ACTIVE_USERS_FLUSH, PLAN_TTL, PLAN_MAX_MESSAGES, MAX_QUEUED_JOBS
+from utils.func import get_user_data, thumbnail, inspect_video, hhmmss
+from utils.func import get_user_data_key, is_premium_user, E, UserSettings, get_user_settings, apply_text_rules
 from shared_client import app as X
-from plugins.settings import rename_file
+from plugins.settings import rename_file, build_file_name
 from plugins.start import subscribe as sub
 from utils.custom_filters import login_in_progress
 from utils.encrypt import dcs
+from utils.transfer import upload_media, relay_media, send_uploaded, download_media, source_media, media_file_name
+from utils.transfer import forward_plain, send_album
+from utils.ratelimit import tg_call
+from utils.retry import with_retries
+from utils.clientpool import ClientPool
+from utils.scheduler import slot
+from utils.progress import report, finish, transfer_text
+from utils.dedupe import lookup_upload, remember_upload, forget_upload
+from utils.singleflight import fetch_shared, release_shared, flight_key
+from utils.peercache import cached_chat, remember_peer, forget_peer
+from utils.persist import JsonFile
 import os
-import json
+import hashlib
 import asyncio
 from typing import Dict, Any, Optional
 
 
 Y = None if not STRING else __import__('shared_client').userbot
-Z, P, UB, UC, emp = {}, {}, {}, {}, {}
+Z, emp = {}, {}
+UB, UC = ClientPool('bot'), ClientPool('user')
 
-ACTIVE_USERS = {}
-ACTIVE_USERS_FILE = "active_users.json"
+# uid -> last /scan: range, fetched messages (None for empty ids) and when it was taken
+PLANS = {}
+# uid -> task running that user's /scan
+SCANS = {}
+# Transfer speed of recent batches in bytes/s, used for /scan estimates
+RATE = {'bps': 0.0}
+ASSUMED_BPS = 2 * 1024 * 1024
 
-def load_active_users():
-    try:
-        if os.path.exists(ACTIVE_USERS_FILE):
-            with open(ACTIVE_USERS_FILE, 'r') as f:
-                return json.load(f)
-        return {}
-    except Exception:
-        return {}
+# "<uid>" -> the user's running batch, saved so it resumes after a restart
+ACTIVE_USERS_FILE = JsonFile("active_users.json", lambda: {k: dict(v) for k, v in ACTIVE_USERS.items()},
+                             ACTIVE_USERS_FLUSH)
+# "<uid>" -> jobs waiting behind the user's running one, oldest first
+QUEUE_FILE = JsonFile("batch_queue.json", lambda: {k: [dict(job) for job in v] for k, v in QUEUE.items()},
+                      ACTIVE_USERS_FLUSH)
+# uid -> task running that user's jobs one after another, and the job it is on
+RUNNERS, RUNNING = {}, {}
+
+def write_active_users():
+    """Write the batch checkpoints and queue now, when the loop may not get to run their writers."""
+    ACTIVE_USERS_FILE.write(ACTIVE_USERS)
+    QUEUE_FILE.write(QUEUE)
 
 async def save_active_users_to_file():
-    try:
-        with open(ACTIVE_USERS_FILE, 'w') as f:
-            json.dump(ACTIVE_USERS, f)
-    except Exception as e:
-        print(f"Error saving active users: {e}")
+    """Mark ACTIVE_USERS and QUEUE dirty; they are written at most every ACTIVE_USERS_FLUSH seconds."""
+    ACTIVE_USERS_FILE.mark_dirty()
+    QUEUE_FILE.mark_dirty()
 
 async def add_active_batch(user_id: int, batch_info: Dict[str, Any]):
     ACTIVE_USERS[str(user_id)] = batch_info
@@ -53,6 +76,8 @@ async def update_batch_progress(user_id: int, current: int, success: int):
     if str(user_id) in ACTIVE_USERS:
         ACTIVE_USERS[str(user_id)]["current"] = current
         ACTIVE_USERS[str(user_id)]["success"] = success
+        if "sid" in ACTIVE_USERS[str(user_id)]:
+            ACTIVE_USERS[str(user_id)]["next"] = ACTIVE_USERS[str(user_id)]["sid"] + current
         await save_active_users_to_file()
 
 async def request_batch_cancel(user_id: int):
@@ -74,26 +99,47 @@ async def remove_active_batch(user_id: int):
 def get_batch_info(user_id: int) -> Optional[Dict[str, Any]]:
     return ACTIVE_USERS.get(str(user_id))
 
-ACTIVE_USERS = load_active_users()
+ACTIVE_USERS = ACTIVE_USERS_FILE.load({})
+QUEUE = QUEUE_FILE.load({})
+
+async def resolve_chat(u, i):
+    """Turn the chat part of a link into a chat id u can use.
 
-async def upd_dlg(c):
+    Resolved peers are kept in the peer cache, so dialogs are only scanned
+    the first time a client meets a chat (or after the cache entry is dropped).
+    """
+    cached = await cached_chat(u, i)
+    if cached is not None:
+        return cached
+    async for _ in u.get_dialogs(limit=50): pass
+    chat_id = i if str(i).startswith('-100') else f'-100{i}' if i.isdigit() else i
     try:
-        async for _ in c.get_dialogs(limit=100): pass
-        return True
+        peer = await u.resolve_peer(chat_id)
+        if hasattr(peer, 'channel_id'): resolved = f'-100{peer.channel_id}'
+        elif hasattr(peer, 'chat_id'): resolved = f'-{peer.chat_id}'
+        elif hasattr(peer, 'user_id'): resolved = peer.user_id
+        else: resolved = chat_id
+        remember_peer(u, i, peer, resolved)
+        return resolved
     except Exception as e:
-        print(f'Failed to update dialogs: {e}')
-        return False
+        print(f"Error resolving peer: {e}")
+        try:
+            return (await tg_call(u.get_chat, chat_id)).id
+        except Exception as e:
+            print(f"Error getting chat: {e}")
+            async for _ in u.get_dialogs(limit=200): pass
+            return chat_id
 
 async def get_msg(c, u, i, d, lt):
     try:
         if lt == 'public':
             try:
-                xm = await c.get_messages(i, d)
+                xm = await tg_call(c.get_messages, i, d)
                 emp[i] = getattr(xm, "empty", False)
                 if emp[i]:
-                    try: await u.join_chat(i)
+                    try: await tg_call(u.join_chat, i)
                     except: pass
-                    xm = await u.get_messages((await u.get_chat(f"@{i}")).id, d)
+                    xm = await tg_call(u.get_messages, (await tg_call(u.get_chat, f"@{i}")).id, d)
                 return xm
             except Exception as e:
                 print(f'Error fetching public message: {e}')
@@ -101,28 +147,12 @@ async def get_msg(c, u, i, d, lt):
         else:
             if u:
                 try:
-                    async for _ in u.get_dialogs(limit=50): pass
-                    chat_id = i if str(i).startswith('-100') else f'-100{i}' if i.isdigit() else i
-                    try:
-                        peer = await u.resolve_peer(chat_id)
-                        if hasattr(peer, 'channel_id'): resolved_id = f'-100{peer.channel_id}'
-                        elif hasattr(peer, 'chat_id'): resolved_id = f'-{peer.chat_id}'
-                        elif hasattr(peer, 'user_id'): resolved_id = peer.user_id
-                        else: resolved_id = chat_id
-                        return await u.get_messages(resolved_id, d)
-                    except Exception as e:
-                        print(f"Error resolving peer: {e}")
-                        try:
-                            chat = await u.get_chat(chat_id)
-                            return await u.get_messages(chat.id, d)
-                        except Exception as e:
-                            print(f"Error getting chat: {e}")
-                            try:
-                                async for _ in u.get_dialogs(limit=200): pass
-                                return await u.get_messages(chat_id, d)
-                            except Exception as e:
-                                print(f"Final attempt error: {e}")
-                                return None
+                    chat = await resolve_chat(u, i)
+                    return await with_retries(lambda: tg_call(u.get_messages, chat, d), label=f'fetch of {i}/{d}')
+                except (PeerIdInvalid, ChannelPrivate) as e:
+                    print(f'Private channel error, dropping cached peer: {e}')
+                    forget_peer(u, i)
+                    return None
                 except Exception as e:
                     print(f'Private channel error: {e}')
                     return None
@@ -131,10 +161,64 @@ async def get_msg(c, u, i, d, lt):
         print(f'Error fetching message: {e}')
         return None
 
+async def iter_msgs(c, u, i, sid, n, lt, chunk=200, planned=None):
+    """Yield (offset, message) for ids sid..sid+n-1, fetching `chunk` ids per call.
+
+    Missing or deleted ids are yielded as None. Replies are not hydrated.
+    `planned` is the same range as already fetched by /scan, which is
+    replayed instead of being fetched again.
+    """
+    if planned is not None:
+        for k, msg in enumerate(planned):
+            yield k, msg
+        return
+    src = user_src = None
+    try:
+        if lt == 'public':
+            emp[i] = False
+            src = (c, i)
+        elif u:
+            src = (u, await resolve_chat(u, i))
+    except Exception as e:
+        print(f'Error resolving source chat: {e}')
+
+    for start in range(0, n, chunk):
+        ids = list(range(sid + start, sid + min(start + chunk, n)))
+        msgs = []
+        try:
+            if src:
+                try:
+                    msgs = await with_retries(lambda: tg_call(src[0].get_messages, src[1], ids, replies=0),
+                                              label=f'fetch of {i}/{ids[0]}-{ids[-1]}')
+                except Exception as e:
+                    if lt != 'public' and src[0] is u and isinstance(e, (PeerIdInvalid, ChannelPrivate)):
+                        print(f'Cached peer for {i} is stale, resolving again: {e}')
+                        forget_peer(u, i)
+                        src = (u, await resolve_chat(u, i))
+                        msgs = await tg_call(u.get_messages, src[1], ids, replies=0)
+                    elif src[0] is not c or not u: raise
+                    else: print(f'Error fetching public messages: {e}')
+                if lt == 'public' and src[0] is c and u and all(not x or x.empty for x in msgs):
+                    # The bot sees nothing here: either a run of deleted posts or a chat it
+                    # cannot read. Ask the user client for this chunk only.
+                    if not user_src:
+                        try: await tg_call(u.join_chat, i)
+                        except: pass
+                        user_src = (u, (await tg_call(u.get_chat, f"@{i}")).id)
+                    msgs = await tg_call(u.get_messages, user_src[1], ids, replies=0)
+                    if any(x and not x.empty for x in msgs):
+                        emp[i] = True
+        except Exception as e:
+            print(f'Error fetching messages {ids[0]}-{ids[-1]}: {e}')
+        found = {x.id: x for x in msgs if x and not x.empty}
+        for k, mid in enumerate(ids):
+            yield start + k, found.get(mid)
+
 async def get_ubot(uid):
     bt = await get_user_data_key(uid, "bot_token", None)
     if not bt: return None
-    if uid in UB: return UB.get(uid)
+    bot = UB.lookup(uid)
+    if bot: return bot
     try:
         bot = Client(f"user_{uid}", bot_token=bt, api_id=API_ID, api_hash=API_HASH)
         await bot.start()
@@ -147,7 +231,7 @@ async def get_ubot(uid):
 async def get_uclient(uid):
     ud = await get_user_data(uid)
     ubot = UB.get(uid)
-    cl = UC.get(uid)
+    cl = UC.lookup(uid)
     if cl: return cl
     if not ud: return ubot if ubot else None
     xxx = ud.get('session_string')
@@ -156,7 +240,6 @@ async def get_uclient(uid):
             ss = dcs(xxx)
             gg = Client(f'{uid}_client', api_id=API_ID, api_hash=API_HASH, device_model="v3saver", session_string=ss)
             await gg.start()
-            await upd_dlg(gg)
             UC[uid] = gg
             return gg
         except Exception as e:
@@ -164,38 +247,29 @@ async def get_uclient(uid):
             return ubot if ubot else Y
     return ubot if ubot else Y
 
+def status(C, h, m, text):
+    report(h, m, partial(C.edit_message_text, h, m), text)
+
 async def prog(c, t, C, h, m, st):
-    global P
-    p = c / t * 100
-    interval = 10 if t >= 100 * 1024 * 1024 else 20 if t >= 50 * 1024 * 1024 else 30 if t >= 10 * 1024 * 1024 else 50
-    step = int(p // interval) * interval
-    if m not in P or P[m] != step or p >= 100:
-        P[m] = step
-        c_mb = c / (1024 * 1024)
-        t_mb = t / (1024 * 1024)
-        bar = '🟢' * int(p / 10) + '🔴' * (10 - int(p / 10))
-        speed = c / (time.time() - st) / (1024 * 1024) if time.time() > st else 0
-        eta = time.strftime('%M:%S', time.gmtime((t - c) / (speed * 1024 * 1024))) if speed > 0 else '00:00'
-        await C.edit_message_text(h, m, f"__**Pyro Handler...**__\n\n{bar}\n\n⚡**__Completed__**: {c_mb:.2f} MB / {t_mb:.2f} MB\n📊 **__Done__**: {p:.2f}%\n🚀 **__Speed__**: {speed:.2f} MB/s\n⏳ **__ETA__**: {eta}\n\n**__Powered by Team SPY__**")
-        if p >= 100: P.pop(m, None)
+    status(C, h, m, transfer_text(c, t, st))
 
 async def send_direct(c, m, tcid, ft=None, rtmid=None):
     try:
         if m.video:
-            await c.send_video(tcid, m.video.file_id, caption=ft, duration=m.video.duration, width=m.video.width, height=m.video.height, reply_to_message_id=rtmid)
+            await tg_call(c.send_video, tcid, m.video.file_id, caption=ft, duration=m.video.duration, width=m.video.width, height=m.video.height, reply_to_message_id=rtmid)
         elif m.video_note:
-            await c.send_video_note(tcid, m.video_note.file_id, reply_to_message_id=rtmid)
+            await tg_call(c.send_video_note, tcid, m.video_note.file_id, reply_to_message_id=rtmid)
         elif m.voice:
-            await c.send_voice(tcid, m.voice.file_id, reply_to_message_id=rtmid)
+            await tg_call(c.send_voice, tcid, m.voice.file_id, reply_to_message_id=rtmid)
         elif m.sticker:
-            await c.send_sticker(tcid, m.sticker.file_id, reply_to_message_id=rtmid)
+            await tg_call(c.send_sticker, tcid, m.sticker.file_id, reply_to_message_id=rtmid)
         elif m.audio:
-            await c.send_audio(tcid, m.audio.file_id, caption=ft, duration=m.audio.duration, performer=m.audio.performer, title=m.audio.title, reply_to_message_id=rtmid)
+            await tg_call(c.send_audio, tcid, m.audio.file_id, caption=ft, duration=m.audio.duration, performer=m.audio.performer, title=m.audio.title, reply_to_message_id=rtmid)
         elif m.photo:
             photo_id = m.photo.file_id if hasattr(m.photo, 'file_id') else m.photo[-1].file_id
-            await c.send_photo(tcid, photo_id, caption=ft, reply_to_message_id=rtmid)
+            await tg_call(c.send_photo, tcid, photo_id, caption=ft, reply_to_message_id=rtmid)
         elif m.document:
-            await c.send_document(tcid, m.document.file_id, caption=ft, file_name=m.document.file_name, reply_to_message_id=rtmid)
+            await tg_call(c.send_document, tcid, m.document.file_id, caption=ft, file_name=m.document.file_name, reply_to_message_id=rtmid)
         else:
             return False
         return True
@@ -203,130 +277,961 @@ async def send_direct(c, m, tcid, ft=None, rtmid=None):
         print(f'Direct send error: {e}')
         return False
 
-async def process_msg(c, u, m, d, lt, uid, i):
+def msg_kind(m):
+    """(kind, media) of a message as /scan and batch filters name it."""
+    kind, media = source_media(m)
+    return kind or ('sticker' if m.sticker else 'text' if m.text else 'other'), media
+
+SIZE_UNITS = {'': 1, 'B': 1, 'KB': 1024, 'MB': 1024 ** 2, 'GB': 1024 ** 3}
+FILTER_TYPES = ('video', 'document', 'photo', 'audio', 'voice', 'video_note', 'sticker', 'text')
+FILTER_HELP = (f'Filters: type={",".join(FILTER_TYPES)} '
+               'min=10MB max=500MB name=regex caption=regex after=YYYY-MM-DD before=YYYY-MM-DD')
+
+def parse_size(v):
+    g = re.fullmatch(r'(\d+(?:\.\d+)?)\s*([KMG]?B?)', v.strip().upper())
+    if not g:
+        raise ValueError(f'Bad size: {v}')
+    return int(float(g[1]) * SIZE_UNITS[g[2] if g[2] in SIZE_UNITS else g[2] + 'B'])
+
+def split_words(text):
+    """Split on whitespace honouring quotes, but keep backslashes so regex filters survive."""
+    lex = shlex.shlex(text, posix=True)
+    lex.whitespace_split = True
+    lex.escape = ''
     try:
-        cfg_chat = await get_user_data_key(d, 'chat_id', None)
-        tcid = d
-        rtmid = None
-        if cfg_chat:
-            if '/' in cfg_chat:
-                parts = cfg_chat.split('/', 1)
-                tcid = int(parts[0])
-                rtmid = int(parts[1]) if len(parts) > 1 else None
-            else:
-                tcid = int(cfg_chat)
+        return list(lex)
+    except ValueError:
+        return text.split()
+
+def parse_filters(words):
+    """Turn `key=value` words typed after the batch count into a filter dict of plain values."""
+    flt = {}
+    for w in words:
+        key, sep, value = w.partition('=')
+        key = key.lower()
+        if not sep or key not in ('type', 'min', 'max', 'name', 'caption', 'after', 'before'):
+            raise ValueError(f'Unknown filter: {w}')
+        flt[key] = value
+    compile_filters(flt)
+    return flt
+
+def parse_types(v):
+    types = set(t.strip().lower() for t in v.split(','))
+    bad = types - set(FILTER_TYPES)
+    if bad:
+        raise ValueError(f'Unknown type: {", ".join(sorted(bad))}')
+    return types
+
+def compile_filters(flt):
+    """Parsed form of a parse_filters() dict, as used by wanted(). Raises ValueError on bad values."""
+    if not flt:
+        return None
+    try:
+        return {
+            'type': parse_types(flt['type']) if 'type' in flt else None,
+            'min': parse_size(flt['min']) if 'min' in flt else None,
+            'max': parse_size(flt['max']) if 'max' in flt else None,
+            'name': re.compile(flt['name'], re.I) if 'name' in flt else None,
+            'caption': re.compile(flt['caption'], re.I) if 'caption' in flt else None,
+            'after': datetime.strptime(flt['after'], '%Y-%m-%d') if 'after' in flt else None,
+            'before': datetime.strptime(flt['before'], '%Y-%m-%d') + timedelta(days=1) if 'before' in flt else None,
+        }
+    except re.error as e:
+        raise ValueError(f'Bad regex: {e}')
+
+def wanted(m, flt):
+    """Whether m passes the compiled batch filters, judged on metadata only."""
+    if not flt:
+        return True
+    kind, media = msg_kind(m)
+    if flt['type'] and kind not in flt['type']:
+        return False
+    size = getattr(media, 'file_size', 0) or 0
+    if (flt['min'] is not None and size < flt['min']) or (flt['max'] is not None and size > flt['max']):
+        return False
+    if flt['name'] and not flt['name'].search(getattr(media, 'file_name', None) or ''):
+        return False
+    if flt['caption'] and not flt['caption'].search((m.caption or m.text or '')):
+        return False
+    if m.date and ((flt['after'] and m.date < flt['after']) or (flt['before'] and m.date >= flt['before'])):
+        return False
+    return True
+
+def media_kind(m, f=None):
+    if m.video or (f and os.path.splitext(f)[1].lower() == '.mp4'):
+        return 'video'
+    for kind in ('video_note', 'voice', 'sticker', 'audio', 'photo'):
+        if getattr(m, kind, None):
+            return kind
+    return 'document'
+
+async def plan_relay(m, d, cfg):
+    """Return (kind, file name) if m can be relayed without touching disk, else None.
+
+    Relaying is skipped when post-processing would need the full file: files
+    above 2GB, and videos that need probing or a generated thumbnail.
+    """
+    if not STREAM_RELAY or m.sticker:
+        return None
+    kind, media = source_media(m)
+    if not media or not media.file_size or media.file_size > 2 * 1024 * 1024 * 1024:
+        return None
+    name = media_file_name(m, kind, media)
+    if getattr(media, 'file_name', None) and kind in ('video', 'audio', 'document'):
+        name = await build_file_name(name, d, cfg)
+    kind = media_kind(m, name) if kind in ('video', 'document') else kind
+    if kind == 'video' and (not m.video or not (thumbnail(d) or m.video.thumbs)):
+        return None
+    return kind, name
+
+def cleanup_job(job):
+    if job.get('flight'):
+        release_shared(job.pop('flight'))
+    for key in ('file', 'thumb_tmp'):
+        f = job.get(key)
+        if f and os.path.exists(f):
+            os.remove(f)
+    f = job.get('file') or job.get('thumb_tmp')
+    if f:
+        try: os.rmdir(os.path.dirname(f))
+        except OSError: pass
+
+def destination(cfg, d):
+    """(chat id, reply-to/topic message id) the user's settings send to."""
+    cfg_chat = cfg.chat_id
+    if not cfg_chat:
+        return d, None
+    if '/' in cfg_chat:
+        parts = cfg_chat.split('/', 1)
+        return int(parts[0]), int(parts[1]) if len(parts) > 1 else None
+    return int(cfg_chat), None
+
+def final_caption(m, cfg):
+    orig_text = m.caption.markdown if m.caption else ''
+    proc_text = apply_text_rules(cfg, orig_text)
+    user_cap = cfg.caption
+    return f'{proc_text}\n\n{user_cap}' if proc_text and user_cap else user_cap if user_cap else proc_text
+
+def upload_variant(cfg, d):
+    """Fingerprint of the settings baked into an upload, so a cached file_id is only reused while they hold."""
+    th = thumbnail(d)
+    parts = (cfg.rename_tag, cfg.delete_words, cfg.replacements, th and os.path.getmtime(th))
+    return hashlib.sha1(repr(parts).encode()).hexdigest()[:16]
+
+async def prepare_job(c, m, d, lt, i, cfg):
+    job = {'msg': m, 'd': d, 'cfg': cfg, 'tcid': d, 'rtmid': None, 'ft': None, 'file': None, 'p': None, 'res': None}
+    job['tcid'], job['rtmid'] = destination(cfg, d)
+
+    if m.media:
+        job['ft'] = final_caption(m, cfg)
+        job['direct'] = lt == 'public' and not emp.get(i, False)
+        media = source_media(m)[1]
+        if media and not job['direct'] and not m.sticker:
+            job['variant'] = upload_variant(cfg, d)
+            job['cached'] = lookup_upload(c, media.file_unique_id, job['tcid'], job['variant'])
+    return job
+
+async def refetch_msg(u, m):
+    """Fetch m again through u, for fresh file references."""
+    fresh = await tg_call(u.get_messages, m.chat.username or m.chat.id, m.id, replies=0)
+    if not fresh or fresh.empty:
+        raise ValueError(f'message {m.id} is gone')
+    return fresh
+
+async def download_job(c, u, job):
+    m, d = job['msg'], job['d']
+    if not m.media or job.get('direct') or m.sticker or job.get('cached'):
+        return
+    job['st'] = time.time()
+    p = job['p'] = job['p'] or await tg_call(c.send_message, d, 'Downloading...')
+    if not job.get('no_relay'):
+        job['relay'] = await plan_relay(m, d, job['cfg'])
+        if job['relay']:
+            return
+
+    resume = {}
+
+    async def refresh():
+        job['msg'] = await refetch_msg(u, job['msg'])
+
+    async def attempt(path):
+        async with slot('download', d):
+            return await download_media(u, job['msg'], path, progress=prog, progress_args=(c, d, p.id, job['st']),
+                                        resume=resume)
+
+    async def fetch(path):
+        return await with_retries(partial(attempt, path), refresh=refresh, label=f'download of message {m.id}')
+
+    media = source_media(m)[1]
+    own = os.path.join('downloads', f'{d}_{m.id}', '')
+    if media:
+        key = flight_key(m, media)
+        f = await fetch_shared(key, fetch, own)
+        if f:
+            job['flight'] = key
+    else:
+        f = await fetch(own)
+    if not f:
+        status(c, d, p.id, 'Failed.')
+        job['res'] = 'Failed.'
+        return
+    job['file'] = f
+
+async def postprocess_job(c, u, job):
+    m, d, p, f = job['msg'], job['d'], job['p'], job['file']
+    if job.get('relay'):
+        job['kind'], job['name'] = job['relay']
+        job['large'] = False
+        job['thumb'] = thumbnail(d)
+        if job['kind'] == 'video':
+            job['meta'] = {'width': m.video.width, 'height': m.video.height, 'duration': m.video.duration}
+            if not job['thumb']:
+                async def refresh():
+                    job['msg'] = await refetch_msg(u, job['msg'])
+
+                async def fetch_thumb():
+                    async with slot('download', d):
+                        return await tg_call(u.download_media, job['msg'].video.thumbs[0].file_id,
+                                             file_name=os.path.join('downloads', f'{d}_{m.id}', 'thumb.jpg'))
+
+                job['thumb'] = job['thumb_tmp'] = await with_retries(fetch_thumb, refresh=refresh,
+                                                                     label=f'thumbnail of message {m.id}')
+        return
+    if not f:
+        return
+    status(c, d, p.id, 'Renaming...')
+    if (
+        (m.video and m.video.file_name) or
+        (m.audio and m.audio.file_name) or
+        (m.document and m.document.file_name)
+    ):
+        f = job['file'] = await rename_file(f, d, p, job['cfg'])
+
+    job['large'] = bool(Y) and os.path.getsize(f) / (1024 * 1024 * 1024) > 2
+    job['kind'] = media_kind(m, f)
+    job['thumb'] = thumbnail(d)
+    if job['large'] or job['kind'] == 'video':
+        job['meta'], shot = await inspect_video(f, m.video, thumb=not job['thumb'])
+        if shot:
+            job['thumb'] = job['thumb_tmp'] = shot
+
+def upload_meta(m, job):
+    kind = job['kind']
+    meta = dict(job.get('meta') or {})
+    if kind == 'video_note':
+        meta.update(duration=m.video_note.duration, length=m.video_note.length)
+    elif kind == 'voice':
+        meta.update(duration=m.voice.duration)
+    elif kind == 'audio':
+        meta.update(duration=m.audio.duration, performer=m.audio.performer, title=m.audio.title)
+    return meta
+
+async def upload_job(c, u, job):
+    m, d, p, f = job['msg'], job['d'], job['p'], job['file']
+    st = time.time()
+    if job.get('relay'):
+        kind = job['kind']
+        try:
+            async with slot('download', d), slot('upload', d):
+                status(c, d, p.id, 'Relaying...')
+                job['media'] = await relay_media(c, u, m, source_media(m)[1].file_size, job['name'], kind, upload_meta(m, job),
+                                                 thumb=job['thumb'] if kind in ('video', 'audio') else None,
+                                                 progress=prog, progress_args=(c, d, p.id, st))
+            return
+        except Exception as e:
+            print(f'Relay failed, falling back to disk: {e}')
+            job.update(relay=None, no_relay=True)
+            await download_job(c, u, job)
+            if job['res']:
+                return
+            await postprocess_job(c, u, job)
+            m, d, p, f = job['msg'], job['d'], job['p'], job['file']
+    if not f:
+        return
+    await upload_file(c, job)
+
+async def upload_file(c, job):
+    m, d, p, f = job['msg'], job['d'], job['p'], job['file']
+    st = time.time()
+    if job['large']:
+        status(c, d, p.id, 'File is larger than 2GB. Using alternative method...')
+        await resolve_chat(Y, str(LOG_GROUP))
+        mtd, th, ft = job['meta'], job['thumb'], job['ft']
+        dur, h, w = mtd['duration'], mtd['height'], mtd['width']
+
+        send_funcs = {'video': Y.send_video, 'video_note': Y.send_video_note, 
+                    'voice': Y.send_voice, 'audio': Y.send_audio, 
+                    'photo': Y.send_photo, 'document': Y.send_document}
         
+        for mtype, func in send_funcs.items():
+            if f.endswith('.mp4'): mtype = 'video'
+            if getattr(m, mtype, None):
+                thumb = th if mtype == 'video' else None
+                break
+        else:
+            mtype, func, thumb = 'document', Y.send_document, th
+
+        async def send_large():
+            async with slot('upload', d):
+                return await tg_call(func, LOG_GROUP, f, thumb=thumb,
+                                     duration=dur if mtype == 'video' else None,
+                                     height=h if mtype == 'video' else None,
+                                     width=w if mtype == 'video' else None,
+                                     caption=ft if m.caption and mtype not in ['video_note', 'voice'] else None,
+                                     reply_to_message_id=job['rtmid'], progress=prog, progress_args=(c, d, p.id, st))
+
+        job['sent'] = await with_retries(send_large, label=f'large upload of message {m.id}')
+        return
+
+    status(c, d, p.id, 'Uploading...')
+    kind = job['kind']
+    resume = {}
+
+    async def attempt():
+        async with slot('upload', d):
+            return await upload_media(c, f, kind, upload_meta(m, job), thumb=job['thumb'] if kind in ('video', 'audio') else None,
+                                      progress=prog, progress_args=(c, d, p.id, st), resume=resume)
+
+    try:
+        job['media'] = await with_retries(attempt, label=f'upload of message {m.id}')
+    except Exception as e:
+        status(c, d, p.id, f'Upload failed: {str(e)[:30]}')
+        job['res'] = 'Failed.'
+
+def remember_sent(c, job, chat_id, sent):
+    media = source_media(sent)[1] if sent else None
+    if media:
+        remember_upload(c, source_media(job['msg'])[1].file_unique_id, chat_id, media.file_id, sent.id,
+                        job.get('variant', ''))
+
+async def send_cached(c, u, job):
+    """Send a file this bot already uploaded to the destination; fall back to a full transfer."""
+    m = job['msg']
+    try:
+        await tg_call(c.send_cached_media, job['tcid'], job['cached']['file_id'],
+                      caption=job['ft'] if m.caption else None, reply_to_message_id=job['rtmid'])
+        return True
+    except Exception as e:
+        print(f'Cached send failed, transferring again: {e}')
+        forget_upload(c, source_media(m)[1].file_unique_id, job['tcid'], job.get('variant', ''))
+        job['cached'] = None
+        for fn in (download_job, postprocess_job, upload_job):
+            await run_stage(fn, job, c, u)
+        return False
+
+async def commit_job(c, u, job):
+    m, d = job['msg'], job['d']
+    try:
+        if job['res']:
+            return job['res']
         if m.media:
-            orig_text = m.caption.markdown if m.caption else ''
-            proc_text = await process_text_with_rules(d, orig_text)
-            user_cap = await get_user_data_key(d, 'caption', '')
-            ft = f'{proc_text}\n\n{user_cap}' if proc_text and user_cap else user_cap if user_cap else proc_text
-            
-            if lt == 'public' and not emp.get(i, False):
-                await send_direct(c, m, tcid, ft, rtmid)
+            if job.get('direct'):
+                await send_direct(c, m, job['tcid'], job['ft'], job['rtmid'])
                 return 'Sent directly.'
-            
-            st = time.time()
-            p = await c.send_message(d, 'Downloading...')
-            
-            f = await u.download_media(m, progress=prog, progress_args=(c, d, p.id, st))
-                
-            if not f:
-                await c.edit_message_text(d, p.id, 'Failed.')
-                return 'Failed.'
-            
-            await c.edit_message_text(d, p.id, 'Renaming...')
-            if (
-                (m.video and m.video.file_name) or
-                (m.audio and m.audio.file_name) or
-                (m.document and m.document.file_name)
-            ):
-                f = await rename_file(f, d, p)
-            
-            fsize = os.path.getsize(f) / (1024 * 1024 * 1024)
-            th = thumbnail(d)
-            
-            if fsize > 2 and Y:
-                st = time.time()
-                await c.edit_message_text(d, p.id, 'File is larger than 2GB. Using alternative method...')
-                await upd_dlg(Y)
-                mtd = await get_video_metadata(f)
-                dur, h, w = mtd['duration'], mtd['width'], mtd['height']
-                th = await screenshot(f, dur, d)
-                
-                send_funcs = {'video': Y.send_video, 'video_note': Y.send_video_note, 
-                            'voice': Y.send_voice, 'audio': Y.send_audio, 
-                            'photo': Y.send_photo, 'document': Y.send_document}
-                
-                for mtype, func in send_funcs.items():
-                    if f.endswith('.mp4'): mtype = 'video'
-                    if getattr(m, mtype, None):
-                        sent = await func(LOG_GROUP, f, thumb=th if mtype == 'video' else None, 
-                                        duration=dur if mtype == 'video' else None,
-                                        height=h if mtype == 'video' else None,
-                                        width=w if mtype == 'video' else None,
-                                        caption=ft if m.caption and mtype not in ['video_note', 'voice'] else None, 
-                                        reply_to_message_id=rtmid, progress=prog, progress_args=(c, d, p.id, st))
-                        break
-                else:
-                    sent = await Y.send_document(LOG_GROUP, f, thumb=th, caption=ft if m.caption else None,
-                                                reply_to_message_id=rtmid, progress=prog, progress_args=(c, d, p.id, st))
-                
-                await c.copy_message(d, LOG_GROUP, sent.id)
-                os.remove(f)
-                await c.delete_messages(d, p.id)
-                
+            if m.sticker:
+                await tg_call(c.send_sticker, job['tcid'], m.sticker.file_id)
+                return 'Done.'
+            if job.get('cached') and await send_cached(c, u, job):
+                return 'Done (cached).'
+            if job['res']:
+                return job['res']
+            if job.get('sent'):
+                sent = await tg_call(c.copy_message, d, LOG_GROUP, job['sent'].id)
+                remember_sent(c, job, d, sent)
+                finish(d, job['p'].id)
+                await tg_call(c.delete_messages, d, job['p'].id)
                 return 'Done (Large file).'
-            
-            await c.edit_message_text(d, p.id, 'Uploading...')
-            st = time.time()
-
-            try:
-                if m.video or os.path.splitext(f)[1].lower() == '.mp4':
-                    mtd = await get_video_metadata(f)
-                    dur, h, w = mtd['duration'], mtd['width'], mtd['height']
-                    th = await screenshot(f, dur, d)
-                    await c.send_video(tcid, video=f, caption=ft if m.caption else None, 
-                                    thumb=th, width=w, height=h, duration=dur, 
-                                    progress=prog, progress_args=(c, d, p.id, st), 
-                                    reply_to_message_id=rtmid)
-                elif m.video_note:
-                    await c.send_video_note(tcid, video_note=f, progress=prog, 
-                                        progress_args=(c, d, p.id, st), reply_to_message_id=rtmid)
-                elif m.voice:
-                    await c.send_voice(tcid, f, progress=prog, progress_args=(c, d, p.id, st), 
-                                    reply_to_message_id=rtmid)
-                elif m.sticker:
-                    await c.send_sticker(tcid, m.sticker.file_id)
-                elif m.audio:
-                    await c.send_audio(tcid, audio=f, caption=ft if m.caption else None, 
-                                    thumb=th, progress=prog, progress_args=(c, d, p.id, st), 
-                                    reply_to_message_id=rtmid)
-                elif m.photo:
-                    await c.send_photo(tcid, photo=f, caption=ft if m.caption else None, 
-                                    progress=prog, progress_args=(c, d, p.id, st), 
-                                    reply_to_message_id=rtmid)
-                else:
-                    await c.send_document(tcid, document=f, caption=ft if m.caption else None, 
-                                        progress=prog, progress_args=(c, d, p.id, st), 
-                                        reply_to_message_id=rtmid)
-            except Exception as e:
-                await c.edit_message_text(d, p.id, f'Upload failed: {str(e)[:30]}')
-                if os.path.exists(f): os.remove(f)
-                return 'Failed.'
-            
-            os.remove(f)
-            await c.delete_messages(d, p.id)
-            
+            sent = await send_uploaded(c, job['tcid'], job['media'], job['ft'] if m.caption else None, job['rtmid'])
+            remember_sent(c, job, job['tcid'], sent)
+            finish(d, job['p'].id)
+            await tg_call(c.delete_messages, d, job['p'].id)
             return 'Done.'
-            
         elif m.text:
-            await c.send_message(tcid, text=m.text.markdown, reply_to_message_id=rtmid)
+            await tg_call(c.send_message, job['tcid'], text=m.text.markdown, reply_to_message_id=job['rtmid'])
             return 'Sent.'
     except Exception as e:
         return f'Error: {str(e)[:50]}'
+    finally:
+        cleanup_job(job)
+
+def album_of(job):
+    """media_group_id of a job ready to be sent as part of an album, else None."""
+    m = job['msg']
+    if not m or job.get('res') or not job.get('media') or job.get('sent') or job.get('cached'):
+        return None
+    return m.media_group_id
+
+async def commit_album(c, u, jobs):
+    """Send the uploaded members of one album together; fall back to one message each."""
+    if len(jobs) == 1:
+        return [await commit_job(c, u, jobs[0])]
+    first = jobs[0]
+    for job in jobs:
+        cleanup_job(job)
+    try:
+        sent = await send_album(c, first['tcid'], [(job['media'], job['ft'] if job['msg'].caption else None)
+                                                   for job in jobs], first['rtmid'])
+    except Exception as e:
+        print(f'Album send failed, sending {len(jobs)} files one by one: {e}')
+        return [await commit_job(c, u, job) for job in jobs]
+    for job, msg in zip(jobs, sent):
+        remember_sent(c, job, job['tcid'], msg)
+        finish(job['d'], job['p'].id)
+    try:
+        await tg_call(c.delete_messages, first['d'], [job['p'].id for job in jobs])
+    except Exception:
+        pass
+    return ['Done.'] * len(jobs)
+
+async def run_stage(fn, job, *args):
+    if job.get('res'):
+        return
+    try:
+        await fn(*args, job)
+    except Exception as e:
+        job['res'] = f'Error: {str(e)[:50]}'
+
+async def process_msg(c, u, m, d, lt, uid, i, cfg=None):
+    try:
+        job = await prepare_job(c, m, d, lt, i, cfg or await get_user_settings(d))
+    except Exception as e:
+        return f'Error: {str(e)[:50]}'
+    await run_stage(download_job, job, c, u)
+    await run_stage(postprocess_job, job, c, u)
+    await run_stage(upload_job, job, c, u)
+    return await commit_job(c, u, job)
+
+class OrderedCommit:
+    """Commits jobs strictly by their 'seq', whatever order they finish in."""
+
+    def __init__(self, commit):
+        self.commit = commit
+        self.next = 0
+        self.ready = {}
+        self.lock = asyncio.Lock()
+
+    async def push(self, job):
+        self.ready[job['seq']] = job
+        async with self.lock:
+            while self.next in self.ready:
+                await self.commit(self.ready.pop(self.next))
+                self.next += 1
+
+async def stage_worker(inq, fn, put):
+    while True:
+        job = await inq.get()
+        if job is None:
+            return
+        await fn(job)
+        await put(job)
+
+async def refresh_settings(uid, d, cfg):
+    if not cfg.is_stale(d):
+        return cfg
+    cfg = await get_user_settings(d)
+    if str(uid) in ACTIVE_USERS:
+        ACTIVE_USERS[str(uid)].update(settings=cfg.snapshot(), settings_version=cfg.version)
+        await save_active_users_to_file()
+    return cfg
+
+async def run_batch(c, u, uid, i, s, n, lt, d, cfg, done=0, success=0, flt=None):
+    """Fetch, download, post-process and upload a batch as overlapping stages.
+
+    Up to BATCH_DOWNLOADS downloads and BATCH_UPLOADS uploads are in flight at
+    once, but messages reach the destination in source message id order.
+    Consecutive members of an album are held back and sent as one album.
+    `done` messages of the range (and `success` of those) are already
+    committed, so a resumed batch continues right after them.
+    `cfg` is the user's settings snapshot; it is only reloaded if the user
+    edits their settings while the batch runs. Messages rejected by the
+    compiled filters `flt` are skipped before any download.
+    Returns (processed, success).
+    """
+    dl_q, pp_q = asyncio.Queue(BATCH_DOWNLOADS), asyncio.Queue(BATCH_DOWNLOADS)
+    up_q = asyncio.Queue(BATCH_UPLOADS)
+    window = asyncio.Semaphore(2 * (BATCH_DOWNLOADS + BATCH_UPLOADS))
+    state = {'fetched': done, 'success': success, 'bytes': 0}
+    album = []
+    started = time.monotonic()
+
+    def count(job, res):
+        if res and ('Done' in res or 'Copied' in res or 'Sent' in res):
+            state['success'] += 1
+            if job.get('media') or job.get('sent'):
+                state['bytes'] += getattr(source_media(job['msg'])[1], 'file_size', 0) or 0
+
+    async def send_held_album():
+        if not album:
+            return
+        jobs = album[:]
+        album.clear()
+        try:
+            for job, res in zip(jobs, await commit_album(c, u, jobs)):
+                count(job, res)
+        except Exception as e:
+            print(f'Error sending album: {e}')
+        await update_batch_progress(uid, jobs[-1]['seq'] + 1, state['success'])
+
+    async def commit(job):
+        gid = album_of(job)
+        if album and gid != album[0]['msg'].media_group_id:
+            await send_held_album()
+        if gid:
+            album.append(job)
+            window.release()
+            return
+        try:
+            res = await commit_job(c, u, job) if job['msg'] else None
+        except Exception as e:
+            res = f'Error: {str(e)[:50]}'
+        count(job, res)
+        window.release()
+        await update_batch_progress(uid, job['seq'] + 1, state['success'])
+
+    committer = OrderedCommit(commit)
+    stages = [
+        (dl_q, [asyncio.create_task(stage_worker(dl_q, lambda job: run_stage(download_job, job, c, u), pp_q.put))
+                for _ in range(BATCH_DOWNLOADS)]),
+        (pp_q, [asyncio.create_task(stage_worker(pp_q, lambda job: run_stage(postprocess_job, job, c, u), up_q.put))
+                for _ in range(BATCH_DOWNLOADS)]),
+        (up_q, [asyncio.create_task(stage_worker(up_q, lambda job: run_stage(upload_job, job, c, u), committer.push))
+                for _ in range(BATCH_UPLOADS)]),
+    ]
+
+    try:
+        async for j, msg in iter_msgs(c, u, i, int(s) + done, n - done, lt,
+                                      planned=planned_msgs(uid, i, int(s) + done, n - done, lt)):
+            j += done
+            if should_cancel(uid):
+                break
+            await window.acquire()
+            cfg = await refresh_settings(uid, d, cfg)
+            try:
+                if not msg or not wanted(msg, flt):
+                    job = {'msg': None, 'res': 'Skipped.'}
+                else:
+                    job = await prepare_job(c, msg, d, lt, i, cfg)
+            except Exception as e:
+                job = {'msg': msg, 'd': d, 'res': f'Error: {str(e)[:50]}'}
+            job['seq'] = j
+            await dl_q.put(job)
+            state['fetched'] = j + 1
+        for q, workers in stages:
+            for _ in workers:
+                await q.put(None)
+            await asyncio.gather(*workers)
+        await send_held_album()
+    finally:
+        for _, workers in stages:
+            for w in workers:
+                w.cancel()
+        record_rate(state['bytes'], time.monotonic() - started)
+    return state['fetched'], state['success']
+
+def alters_files(cfg, d):
+    """Whether uploads for d would differ from the source files (name or thumbnail)."""
+    return bool(cfg.rename_tag or cfg.name_rules.regex or thumbnail(d))
+
+async def copy_source(c, u, i, lt, d, cfg):
+    """Return (client, chat id) that can copy the batch source server-side, or None.
+
+    Protected chats must be downloaded, and so must every batch whose files
+    the user's rename tag, file name rules or custom thumbnail would change,
+    since a copy keeps the original name and thumbnail. Otherwise the bot
+    copies from public chats; private ones need the user client, which can
+    only post to a destination chat the user configured (not to their chat
+    with the bot).
+    """
+    if alters_files(cfg, d):
+        return None
+    if lt == 'public':
+        cl, chat = c, i
+    elif u and cfg.chat_id:
+        cl, chat = u, await resolve_chat(u, i)
+    else:
+        return None
+    try:
+        info = await tg_call(cl.get_chat, chat)
+    except Exception as e:
+        print(f'Could not check source chat {i} for copying: {e}')
+        return None
+    return None if info.has_protected_content else (cl, info.id)
+
+async def copy_batch(c, u, uid, i, s, n, lt, d, cfg, src, done=0, success=0, flt=None):
+    """Copy a batch server-side, without downloading or uploading anything.
+
+    Runs of messages whose caption the user's rules leave untouched are
+    forwarded without author, up to 100 ids per call and never splitting an
+    album; rewritten captions are copied one by one, or per album with
+    copy_media_group. With filters `flt`, album members are handled as single
+    messages, since only some of them may pass. If the server refuses, the
+    rest of the batch continues through run_batch() from the first message
+    not yet sent.
+    Returns (processed, success).
+    """
+    cl, chat = src
+    tcid, rtmid = destination(cfg, d)
+    state = {'fetched': done, 'success': success}
+    run, group = [], []
+
+    async def flush():
+        if not run:
+            return None
+        try:
+            await forward_plain(cl, chat, [m.id for _, m in run], tcid, rtmid)
+        except Exception as e:
+            print(f'Bulk copy of {len(run)} messages failed: {e}')
+            return run[0][0]
+        state['success'] += len(run)
+        await update_batch_progress(uid, run[-1][0] + 1, state['success'])
+        run.clear()
+        return None
+
+    async def take_group():
+        if not group:
+            return None
+        members = group[:]
+        group.clear()
+        caps = [final_caption(m, cfg) if m.caption else None for _, m in members]
+        if all(cap is None or cap == m.caption.markdown for cap, (_, m) in zip(caps, members)):
+            handoff = await flush() if len(run) + len(members) > 100 else None
+            run.extend(members)
+            return handoff
+        handoff = await flush()
+        if handoff is not None:
+            return handoff
+        try:
+            await tg_call(cl.copy_media_group, tcid, chat, members[0][1].id, captions=caps, reply_to_message_id=rtmid)
+        except Exception as e:
+            print(f'Copy of album {members[0][1].media_group_id} failed: {e}')
+            return members[0][0]
+        state['success'] += len(members)
+        await update_batch_progress(uid, members[-1][0] + 1, state['success'])
+        return None
+
+    async def send_pending():
+        handoff = await take_group()
+        return handoff if handoff is not None else await flush()
+
+    handoff = None
+    async for j, msg in iter_msgs(c, u, i, int(s) + done, n - done, lt,
+                                  planned=planned_msgs(uid, i, int(s) + done, n - done, lt)):
+        j += done
+        if should_cancel(uid):
+            break
+        switched = lt == 'public' and emp.get(i)
+        if switched or cfg.is_stale(d):
+            handoff = await send_pending()
+            if switched and handoff is None:
+                handoff = j
+            if handoff is not None:
+                break
+            cfg = await refresh_settings(uid, d, cfg)
+            tcid, rtmid = destination(cfg, d)
+            if alters_files(cfg, d):
+                handoff = j
+                break
+        if group and (not msg or msg.media_group_id != group[0][1].media_group_id):
+            handoff = await take_group()
+            if handoff is not None:
+                break
+        state['fetched'] = j + 1
+        if not msg or not (msg.media or msg.text) or not wanted(msg, flt):
+            continue
+        if msg.media_group_id and not flt:
+            group.append((j, msg))
+            continue
+        ft = final_caption(msg, cfg) if msg.caption else None
+        if ft is not None and ft != msg.caption.markdown:
+            handoff = await flush()
+            if handoff is not None:
+                break
+            try:
+                await tg_call(cl.copy_message, tcid, chat, msg.id, caption=ft, reply_to_message_id=rtmid)
+            except Exception as e:
+                print(f'Copy of message {msg.id} failed: {e}')
+                handoff = j
+                break
+            state['success'] += 1
+            await update_batch_progress(uid, j + 1, state['success'])
+        else:
+            run.append((j, msg))
+            if len(run) >= 100:
+                handoff = await flush()
+                if handoff is not None:
+                    break
+    if handoff is None:
+        handoff = await send_pending()
+    if handoff is not None and not should_cancel(uid):
+        print(f'Server-side copy stopped at {handoff}/{n}, transferring the rest')
+        return await run_batch(c, u, uid, i, s, n, lt, d, cfg, handoff, state['success'], flt)
+    return state['fetched'] if handoff is None else handoff, state['success']
+
+def record_rate(nbytes, seconds):
+    if nbytes and seconds > 5:
+        bps = nbytes / seconds
+        RATE['bps'] = 0.7 * RATE['bps'] + 0.3 * bps if RATE['bps'] else bps
+
+def planned_msgs(uid, i, sid, n, lt):
+    """Messages sid..sid+n-1 from uid's last /scan of chat i, or None if not covered or too old."""
+    plan = PLANS.get(uid)
+    if plan and time.time() - plan['at'] > PLAN_TTL:
+        del PLANS[uid]
+        return None
+    if not plan or (plan['cid'], plan['lt']) != (i, lt):
+        return None
+    first = sid - plan['sid']
+    if first < 0 or first + n > len(plan['msgs']):
+        return None
+    emp[i] = plan['empty']
+    return plan['msgs'][first:first + n]
+
+def duration_text(seconds):
+    days = int(seconds // 86400)
+    return f'{days}d {hhmmss(seconds)}' if days else hhmmss(seconds)
+
+def scan_stats(n):
+    """Empty running totals for a /scan of n messages, split into ~10 id ranges."""
+    return {'kinds': {}, 'empty': 0, 'skipped': 0, 'protected': 0, 'big': 0, 'size': 0,
+            'ranges': {}, 'step': max(1, -(-n // 10))}
+
+def tally(stats, k, m, flt=None):
+    """Count the k-th scanned message m into stats."""
+    if not m or not (m.media or m.text):
+        stats['empty'] += 1
+        return
+    if not wanted(m, flt):
+        stats['skipped'] += 1
+        return
+    kind, media = msg_kind(m)
+    stats['kinds'][kind] = stats['kinds'].get(kind, 0) + 1
+    fs = getattr(media, 'file_size', 0) or 0
+    stats['size'] += fs
+    stats['big'] += fs > 2 * 1024 * 1024 * 1024
+    stats['protected'] += bool(m.has_protected_content)
+    r = stats['ranges'].setdefault(k // stats['step'], [0, 0])
+    r[0] += 1
+    r[1] += fs
+
+def manifest_text(stats, sid, n, copyable, flt=None, kept=True):
+    """Summarise a /scan: what the range holds and roughly how long it takes."""
+    kinds, size, step = stats['kinds'], stats['size'], stats['step']
+    found = n - stats['empty'] - stats['skipped']
+    if copyable:
+        eta = -(-found // 100)
+        how = 'Source is not protected, messages are copied server-side (no download).'
+    else:
+        rate = RATE['bps'] or ASSUMED_BPS
+        eta = size / rate
+        how = (f"Files are downloaded and re-uploaded at ~{rate / (1024 * 1024):.2f} MB/s "
+               f"({'measured' if RATE['bps'] else 'assumed'}).")
+    lines = [
+        f'📋 **Batch plan** for {n} messages from {sid}\n',
+        'Media: ' + (', '.join(f'{k} {v}' for k, v in sorted(kinds.items(), key=lambda x: -x[1])) or 'none'),
+        f"Empty / deleted: {stats['empty']}" + (f", filtered out: {stats['skipped']}" if flt else ''),
+        f"Total size: {size / (1024 ** 3):.2f} GB ({stats['big']} files over 2 GB)",
+        f"Protected: {stats['protected']}, copyable: {found - stats['protected']}",
+        how,
+        f'ETA: ~{duration_text(eta)}\n',
+        'By range:',
+    ]
+    for k, (count, fs) in sorted(stats['ranges'].items()):
+        first, last = sid + k * step, min(sid + (k + 1) * step, sid + n) - 1
+        lines.append(f'`{first}-{last}`: {count} messages, {fs / (1024 ** 2):.1f} MB')
+    if kept:
+        lines.append(f'\nRun /batch with the same link within {PLAN_TTL // 60} min to reuse this scan, '
+                     'or with a narrower range of it.')
+    else:
+        lines.append(f'\nRanges over {PLAN_MAX_MESSAGES} messages are not kept, /batch fetches them again.')
+    return '\n'.join(lines)
+
+async def scan_batch(c, u, uid, i, s, n, lt, d, pt, flt=None):
+    """Fetch only the metadata of a batch range and reply with its manifest.
+
+    Ranges of up to PLAN_MAX_MESSAGES are kept as uid's plan for /batch to
+    replay; larger ones are only tallied, so a big scan never holds every
+    Message in memory.
+    """
+    cfg = await get_user_settings(d)
+    src = await copy_source(c, u, i, lt, d, cfg)
+    compiled = compile_filters(flt)
+    kept = n <= PLAN_MAX_MESSAGES
+    stats, msgs = scan_stats(n), []
+    async for j, msg in iter_msgs(c, u, i, int(s), n, lt):
+        tally(stats, j, msg, compiled)
+        if kept:
+            msgs.append(msg)
+        if (j + 1) % 200 == 0:
+            status(X, int(d), pt.id, f'Scanning... {j + 1}/{n}')
+    now = time.time()
+    # Plans hold whole messages, so drop the ones nobody ran before their TTL
+    for k in [k for k, plan in PLANS.items() if now - plan['at'] > PLAN_TTL]:
+        del PLANS[k]
+    if kept:
+        PLANS[uid] = {'cid': i, 'sid': int(s), 'lt': lt, 'at': now, 'empty': emp.get(i, False), 'msgs': msgs}
+    else:
+        PLANS.pop(uid, None)
+    finish(int(d), pt.id)
+    await tg_call(pt.edit, manifest_text(stats, int(s), n, src is not None, compiled, kept))
+
+async def run_scan(ubot, uc, uid, i, s, n, lt, d, pt, flt=None):
+    try:
+        async with UB.hold(uid), UC.hold(uid):
+            await scan_batch(ubot, uc, uid, i, s, n, lt, d, pt, flt)
+    except Exception as e:
+        finish(int(d), pt.id)
+        await tg_call(pt.edit, f'Error: {str(e)[:50]}')
+    finally:
+        if SCANS.get(uid) is asyncio.current_task():
+            del SCANS[uid]
+
+def job_settings(job):
+    """The settings snapshot a job was queued with, or fresh ones if the user has changed them since."""
+    if 'settings' not in job:
+        return None
+    cfg = UserSettings.from_data(job['did'], job['settings'])._replace(version=job.get('settings_version', -1))
+    return None if cfg.is_stale(job['did']) else cfg
+
+async def execute_batch(ubot, uc, uid, info):
+    """Run the batch described by the ACTIVE_USERS record `info`, from its checkpoint."""
+    n, did = info['total'], info['did']
+    cfg = job_settings(info) or await get_user_settings(did)
+    info.update(settings=cfg.snapshot(), settings_version=cfg.version)
+    await add_active_batch(uid, info)
+    try:
+        async with UB.hold(uid), UC.hold(uid):
+            args = (ubot, uc, uid, info['cid'], info['sid'], n, info['lt'], did, cfg)
+            flt = compile_filters(info.get('filters'))
+            src = await copy_source(ubot, uc, info['cid'], info['lt'], did, cfg)
+            if src:
+                done, success = await copy_batch(*args, src, info['current'], info['success'], flt)
+            else:
+                done, success = await run_batch(*args, info['current'], info['success'], flt)
+    except asyncio.CancelledError:
+        # Shutdown, not /cancel: keep the checkpoint on disk so the batch resumes
+        write_active_users()
+        raise
+    except Exception:
+        await remove_active_batch(uid)
+        raise
+    finally:
+        PLANS.pop(uid, None)
+    await remove_active_batch(uid)
+    if done < n:
+        await tg_call(X.edit_message_text, int(did), info['progress_message_id'], f'Cancelled at {done}/{n}. Success: {success}')
+    else:
+        await tg_call(X.send_message, int(did), f'Batch Completed ✅ Success: {success}/{n}')
+
+async def resume_batch(uid, info):
+    uc = await get_uclient(uid)
+    ubot = await get_ubot(uid)
+    if not uc or not ubot:
+        print(f'Cannot resume batch for user {uid}: missing client setup')
+        await remove_active_batch(uid)
+        return
+    try:
+        await tg_call(X.send_message, int(info['did']),
+                      f"Resuming your batch at {info['current']}/{info['total']} after a restart...")
+    except Exception as e:
+        print(f'Could not notify user {uid} about resume: {e}')
+    await execute_batch(ubot, uc, uid, info)
+
+async def run_single(ubot, uc, uid, job):
+    pmid = job['progress_message_id']
+    try:
+        async with UB.hold(uid), UC.hold(uid):
+            msg = await get_msg(ubot, uc, job['cid'], job['sid'], job['lt'])
+            if msg:
+                res = await process_msg(ubot, uc, msg, job['did'], job['lt'], uid, job['cid'], job_settings(job))
+                await tg_call(X.edit_message_text, int(job['did']), pmid, f'1/1: {res}')
+            else:
+                await tg_call(X.edit_message_text, int(job['did']), pmid, 'Message not found')
+    except Exception as e:
+        await tg_call(X.edit_message_text, int(job['did']), pmid, f'Error: {str(e)[:50]}')
+
+def job_text(job):
+    kind = 'Single' if job.get('kind') == 'single' else f"Batch of {job['total']}"
+    return f"{kind} from {job['cid']}/{job['sid']}" + (' (filtered)' if job.get('filters') else '')
+
+async def run_job(uid, job):
+    ubot, uc = await get_ubot(uid), await get_uclient(uid)
+    did, pmid = int(job['did']), job['progress_message_id']
+    if not ubot or not uc:
+        await tg_call(X.edit_message_text, did, pmid, 'Missing client setup')
+        return
+    try:
+        await tg_call(X.edit_message_text, did, pmid, 'Processing...' if job['kind'] == 'single' else 'Processing batch...')
+    except Exception:
+        pass
+    if job['kind'] == 'single':
+        await run_single(ubot, uc, uid, job)
+    else:
+        await execute_batch(ubot, uc, uid, job)
+
+async def drain_queue(uid, resume=None):
+    """Run uid's queued jobs one after another, after the interrupted batch `resume` if any."""
+    try:
+        if resume:
+            RUNNING[uid] = resume
+            await resume_batch(uid, resume)
+        while QUEUE.get(str(uid)):
+            job = RUNNING[uid] = QUEUE[str(uid)].pop(0)
+            if not QUEUE[str(uid)]:
+                del QUEUE[str(uid)]
+            await save_active_users_to_file()
+            try:
+                await run_job(uid, job)
+            except Exception as e:
+                print(f'Error running queued job for user {uid}: {e}')
+    finally:
+        RUNNING.pop(uid, None)
+        if RUNNERS.get(uid) is asyncio.current_task():
+            del RUNNERS[uid]
+
+def is_user_busy(uid):
+    task = RUNNERS.get(uid)
+    return bool(task and not task.done())
 
-@X.on_message(filters.command(['batch', 'single']))
+def start_runner(uid, resume=None):
+    if not is_user_busy(uid):
+        RUNNERS[uid] = asyncio.create_task(drain_queue(uid, resume))
+
+async def enqueue_job(uid, job):
+    """Queue a /batch or /single job for uid and return how many jobs are ahead of it, or None if full."""
+    if len(QUEUE.get(str(uid), [])) >= MAX_QUEUED_JOBS:
+        return None
+    cfg = await get_user_settings(job['did'])
+    job.update(settings=cfg.snapshot(), settings_version=cfg.version)
+    queue = QUEUE.setdefault(str(uid), [])
+    ahead = len(queue) + is_user_busy(uid)
+    job['qid'] = max([j['qid'] for j in queue] + [RUNNING.get(uid, {}).get('qid', 0)]) + 1
+    queue.append(job)
+    await save_active_users_to_file()
+    start_runner(uid)
+    return ahead
+
+async def queue_reply(uid, pt, job):
+    """Queue job and tell the user on its status message pt whether it starts now or waits."""
+    ahead = await enqueue_job(uid, job)
+    if ahead is None:
+        await pt.edit(f'You already have {MAX_QUEUED_JOBS} jobs queued. Wait for them or drop some with /dequeue.')
+    elif ahead:
+        await pt.edit(f"Queued as #{job['qid']}, {ahead} job{'s' if ahead > 1 else ''} ahead. "
+                      'It starts as soon as the previous one finishes. See /queue.')
+
+async def run_batch_plugin():
+    """Re-queue batches that were still running when the bot last stopped, then their queued jobs."""
+    for key, info in list(ACTIVE_USERS.items()):
+        if info.get('cancel_requested') or 'cid' not in info:
+            await remove_active_batch(int(key))
+            continue
+        print(f"Resuming batch for user {key} from message {info.get('next', info['sid'])}")
+        start_runner(int(key), info)
+    for key in list(QUEUE):
+        print(f"Starting {len(QUEUE[key])} queued jobs for user {key}")
+        start_runner(int(key))
+
+@X.on_message(filters.command(['batch', 'single', 'scan']))
 async def process_cmd(c, m):
     r = await sub(c, m)
     if r == 1: return
@@ -342,17 +1247,13 @@ async def process_cmd(c, m):
     
     pro = await m.reply_text('Doing some checks hold on...')
     
-    if is_user_active(uid):
-        await pro.edit('You have an active task. Use /stop to cancel it.')
-        return
-    
     ubot = await get_ubot(uid)
     if not ubot:
         await pro.edit('Add your bot with /setbot first')
         return
     
-    Z[uid] = {'step': 'start' if m.command[0] == 'batch' else 'start_single'}
-    await pro.edit(f'Send {"start link..." if m.command[0] == "batch" else "link you to process"}.')
+    Z[uid] = {'step': 'start_single' if m.command[0] == 'single' else 'start', 'scan': m.command[0] == 'scan'}
+    await pro.edit(f'Send {"link you to process" if m.command[0] == "single" else "start link"}...')
 
 @X.on_message(filters.command(['cancel', 'stop']))
 async def cancel_cmd(c, m):
@@ -364,9 +1265,47 @@ async def cancel_cmd(c, m):
             await m.reply_text('Failed to request cancellation. Please try again.')
     else:
         await m.reply_text('No active batch process found.')
+    if QUEUE.get(str(uid)):
+        await m.reply_text('Your queued jobs will still run. Use /queue to see them or /dequeue all to drop them.')
+
+@X.on_message(filters.command('queue'))
+async def queue_cmd(c, m):
+    uid = m.from_user.id
+    lines = []
+    job = RUNNING.get(uid)
+    if job:
+        info = ACTIVE_USERS.get(str(uid))
+        done = f" ({info['current']}/{info['total']})" if info and job.get('kind') != 'single' else ''
+        lines.append(f"▶️ {job_text(job)}{done}")
+    lines += [f"#{job['qid']} {job_text(job)}" for job in QUEUE.get(str(uid), [])]
+    if not lines:
+        await m.reply_text('You have no running or queued jobs.')
+        return
+    await m.reply_text('📋 **Your jobs**\n\n' + '\n'.join(lines) + '\n\nUse /dequeue <id> or /dequeue all to drop queued jobs.')
+
+@X.on_message(filters.command('dequeue'))
+async def dequeue_cmd(c, m):
+    uid = m.from_user.id
+    queue = QUEUE.get(str(uid), [])
+    arg = m.command[1].lower() if len(m.command) > 1 else ''
+    if arg == 'all':
+        dropped = [job['qid'] for job in queue]
+    elif arg.lstrip('#').isdigit():
+        dropped = [job['qid'] for job in queue if job['qid'] == int(arg.lstrip('#'))]
+    else:
+        await m.reply_text('Usage: /dequeue <id> or /dequeue all (ids are listed by /queue)')
+        return
+    if not dropped:
+        await m.reply_text('No such queued job.')
+        return
+    queue[:] = [job for job in queue if job['qid'] not in dropped]
+    if not queue:
+        QUEUE.pop(str(uid), None)
+    await save_active_users_to_file()
+    await m.reply_text(f"Dropped {len(dropped)} queued job{'s' if len(dropped) > 1 else ''}.")
 
 @X.on_message(filters.text & filters.private & ~login_in_progress & ~filters.command([
-    'start', 'batch', 'cancel', 'login', 'logout', 'stop', 'set', 
+    'start', 'batch', 'scan', 'queue', 'dequeue', 'cancel', 'login', 'logout', 'stop', 'set', 
     'pay', 'redeem', 'gencode', 'single', 'generate', 'keyinfo', 'encrypt', 'decrypt', 'keys', 'setbot', 'rembot']))
 async def text_handler(c, m):
     uid = m.from_user.id
@@ -381,7 +1320,8 @@ async def text_handler(c, m):
             Z.pop(uid, None)
             return
         Z[uid].update({'step': 'count', 'cid': i, 'sid': d, 'lt': lt})
-        await m.reply_text('How many messages?')
+        await m.reply_text(f'How many messages? Optionally add filters after the number, '
+                           f'e.g. `50 type=video max=500MB`\n\n{FILTER_HELP}')
 
     elif s == 'start_single':
         L = m.text
@@ -395,7 +1335,7 @@ async def text_handler(c, m):
         i, s, lt = Z[uid]['cid'], Z[uid]['sid'], Z[uid]['lt']
         pt = await m.reply_text('Processing...')
         
-        ubot = UB.get(uid)
+        ubot = await get_ubot(uid)
         if not ubot:
             await pt.edit('Add bot with /setbot first')
             Z.pop(uid, None)
@@ -406,30 +1346,29 @@ async def text_handler(c, m):
             await pt.edit('Cannot proceed without user client.')
             Z.pop(uid, None)
             return
-            
-        if is_user_active(uid):
-            await pt.edit('Active task exists. Use /stop first.')
-            Z.pop(uid, None)
-            return
 
-        try:
-            msg = await get_msg(ubot, uc, i, s, lt)
-            if msg:
-                res = await process_msg(ubot, uc, msg, str(m.chat.id), lt, uid, i)
-                await pt.edit(f'1/1: {res}')
-            else:
-                await pt.edit('Message not found')
-        except Exception as e:
-            await pt.edit(f'Error: {str(e)[:50]}')
-        finally:
-            Z.pop(uid, None)
+        Z.pop(uid, None)
+        await queue_reply(uid, pt, {
+            "kind": "single",
+            "cid": i,
+            "sid": int(s),
+            "lt": lt,
+            "did": str(m.chat.id),
+            "progress_message_id": pt.id
+            })
 
     elif s == 'count':
-        if not m.text.isdigit():
+        words = split_words(m.text)
+        if not words or not words[0].isdigit():
             await m.reply_text('Enter valid number.')
             return
+        try:
+            flt = parse_filters(words[1:])
+        except ValueError as e:
+            await m.reply_text(f'{e}\n\n{FILTER_HELP}')
+            return
         
-        count = int(m.text)
+        count = int(words[0])
         # Unlimited downloads for all users (up to 100,000)
         maxlimit = 100000
 
@@ -439,58 +1378,36 @@ async def text_handler(c, m):
 
         Z[uid].update({'step': 'process', 'did': str(m.chat.id), 'num': count})
         i, s, n, lt = Z[uid]['cid'], Z[uid]['sid'], Z[uid]['num'], Z[uid]['lt']
-        success = 0
 
         pt = await m.reply_text('Processing batch...')
+        ubot = await get_ubot(uid)
         uc = await get_uclient(uid)
-        ubot = UB.get(uid)
         
         if not uc or not ubot:
             await pt.edit('Missing client setup')
             Z.pop(uid, None)
             return
-            
-        if is_user_active(uid):
-            await pt.edit('Active task exists')
+
+        if Z[uid].get('scan'):
             Z.pop(uid, None)
+            if uid in SCANS:
+                await pt.edit('A scan is already running for you, wait for its manifest.')
+                return
+            # Scans can take minutes, so they run off the handler like queued jobs
+            SCANS[uid] = asyncio.create_task(run_scan(ubot, uc, uid, i, s, n, lt, str(m.chat.id), pt, flt))
             return
         
-        await add_active_batch(uid, {
+        Z.pop(uid, None)
+        await queue_reply(uid, pt, {
+            "kind": "batch",
+            "cid": i,
+            "sid": int(s),
+            "lt": lt,
+            "did": str(m.chat.id),
             "total": n,
             "current": 0,
             "success": 0,
             "cancel_requested": False,
-            "progress_message_id": pt.id
+            "progress_message_id": pt.id,
+            "filters": flt
             })
-        
-        try:
-            for j in range(n):
-                
-                if should_cancel(uid):
-                    await pt.edit(f'Cancelled at {j}/{n}. Success: {success}')
-                    break
-                
-                await update_batch_progress(uid, j, success)
-                
-                mid = int(s) + j
-                
-                try:
-                    msg = await get_msg(ubot, uc, i, mid, lt)
-                    if msg:
-                        res = await process_msg(ubot, uc, msg, str(m.chat.id), lt, uid, i)
-                        if 'Done' in res or 'Copied' in res or 'Sent' in res:
-                            success += 1
-                    else:
-                        pass
-                except Exception as e:
-                    try: await pt.edit(f'{j+1}/{n}: Error - {str(e)[:30]}')
-                    except: pass
-                
-                await asyncio.sleep(10)
-            
-            if j+1 == n:
-                await m.reply_text(f'Batch Completed ✅ Success: {success}/{n}')
-        
-        finally:
-            await remove_active_batch(uid)
-            Z.pop(uid, None)
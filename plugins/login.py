@@ -10,6 +10,7 @@ import os
 from config import API_HASH, API_ID
 from shared_client import app as bot
 from utils.func import save_user_session, get_user_data, remove_user_session, save_user_bot, remove_user_bot
+from utils.transfer import close_media_sessions
 from utils.encrypt import ecs, dcs
 from plugins.batch import UB, UC
 from utils.custom_filters import login_in_progress, set_user_step, get_user_step
@@ -41,6 +42,7 @@ async def set_bot_token(C, m):
     args = m.text.split(" ", 1)
     if user_id in UB:
         try:
+            await close_media_sessions(UB[user_id])
             await UB[user_id].stop()
             if UB.get(user_id, None):
                 del UB[user_id]  # Remove from dictionary
@@ -70,6 +72,7 @@ async def rem_bot_token(C, m):
     user_id = m.from_user.id
     if user_id in UB:
         try:
+            await close_media_sessions(UB[user_id])
             await UB[user_id].stop()
             
             if UB.get(user_id, None):
@@ -266,16 +269,14 @@ Still removing from database..."""
                 os.remove(f"{user_id}_client.session")
         except Exception:
             pass
-        if UC.get(user_id, None):
-            del UC[user_id]
+        await UC.discard(user_id)
     except Exception as e:
         logger.error(f'Error in logout command: {str(e)}')
         try:
             await remove_user_session(user_id)
         except Exception:
             pass
-        if UC.get(user_id, None):
-            del UC[user_id]
+        await UC.discard(user_id)
         await edit_message_safely(status_msg,
             f'❌ An error occurred during logout: {str(e)}')
         try:
@@ -22,7 +22,12 @@ from telethon.tl.types import DocumentAttributeVideo
 
 # Import the shared clients
 from ..shared_client import client, app, userbot
-from ..utils.func import fast_upload, get_video_metadata, screenshot, progress_callback
+from ..utils.func import fast_upload, get_video_metadata, screenshot
+from ..utils.ratelimit import tg_call
+from ..utils.scheduler import slot
+from ..utils.progress import progress_callback, finish
+from ..utils.singleflight import fetch_shared, release_shared, flight_key
+from ..utils.transfer import download_media
 
 # Cache to store already verified chat access
 VERIFIED_CHATS = {}
@@ -97,7 +102,7 @@ async def verify_channel_access(user_client, chat_id, user_id=None):
     
     try:
         # Try to get basic info about the chat
-        chat = await user_client.get_chat(chat_id)
+        chat = await tg_call(user_client.get_chat, chat_id)
         VERIFIED_CHATS[chat_key] = True
         return True, chat
     except ChannelPrivate:
@@ -118,7 +123,7 @@ async def verify_channel_access(user_client, chat_id, user_id=None):
 async def attempt_channel_join(user_client, invite_link, user_id=None):
     """Attempt to join a channel using an invite link"""
     try:
-        await user_client.join_chat(invite_link)
+        await tg_call(user_client.join_chat, invite_link)
         return True
     except InviteHashExpired:
         return False
@@ -176,26 +181,26 @@ async def save_restricted_content(event):
     # Process the link
     chat, msg_id, chat_type = await process_link(msg_link)
     if not chat or not msg_id:
-        await status_msg.edit("🚫 Invalid link format. Please check your link.")
+        await tg_call(status_msg.edit, "🚫 Invalid link format. Please check your link.")
         return
     
     try:
         # Verify access to the chat
-        await status_msg.edit("🔍 Checking access to content...")
+        await tg_call(status_msg.edit, "🔍 Checking access to content...")
         access_result, chat_info = await verify_channel_access(userbot, chat)
         
         if not access_result:
             # Try to join if it's a channel invite link
             if msg_link.startswith('https://t.me/+') or msg_link.startswith('https://t.me/joinchat/'):
-                await status_msg.edit("🔑 Trying to join channel with invite link...")
+                await tg_call(status_msg.edit, "🔑 Trying to join channel with invite link...")
                 join_success = await attempt_channel_join(userbot, msg_link)
                 if not join_success:
-                    await status_msg.edit(
+                    await tg_call(status_msg.edit,
                         "🔒 Failed to join channel. The invite link may be expired or invalid."
                     )
                     return
             else:
-                await status_msg.edit(
+                await tg_call(status_msg.edit,
                     "🔒 Cannot access this content. Please make sure:\n"
                     "1. The user session has access to this channel/chat\n"
                     "2. For private channels, try sending an invite link first"
@@ -203,40 +208,50 @@ async def save_restricted_content(event):
                 return
         
         # Get the message
-        await status_msg.edit("📥 Accessing message...")
+        await tg_call(status_msg.edit, "📥 Accessing message...")
         try:
-            msg = await userbot.get_messages(chat, msg_id)
+            msg = await tg_call(userbot.get_messages, chat, msg_id)
             if not msg:
-                await status_msg.edit("❌ Message not found or you don't have access to it.")
+                await tg_call(status_msg.edit, "❌ Message not found or you don't have access to it.")
                 return
         except Exception as e:
-            await status_msg.edit(f"❌ Failed to get message: {str(e)}")
+            await tg_call(status_msg.edit, f"❌ Failed to get message: {str(e)}")
             return
         
         # Handle text messages
         if not msg.media and msg.text:
-            await status_msg.edit("📋 Forwarding text message...")
-            await app.send_message(user_id, msg.text)
+            await tg_call(status_msg.edit, "📋 Forwarding text message...")
+            await tg_call(app.send_message, user_id, msg.text)
             await status_msg.delete()
             return
         
         # Handle media messages
-        await status_msg.edit("⬇️ Downloading content...")
+        await tg_call(status_msg.edit, "⬇️ Downloading content...")
         
-        # Download the media
+        # Download the media, sharing it with anyone fetching the same post right now
         download_path = f"downloads/{user_id}_{int(time.time())}"
-        os.makedirs(os.path.dirname(download_path), exist_ok=True)
+        media = getattr(msg, msg.media.value, None)
+        flight = flight_key(msg, media) if getattr(media, 'file_unique_id', None) else None
+        file_path = None
+        
+        async def fetch(path):
+            async with slot('download', user_id):
+                return await download_media(
+                    userbot,
+                    msg,
+                    path,
+                    progress=progress_callback,
+                    progress_args=(user_id, app, status_msg, "Downloading")
+                )
         
         try:
-            file_path = await userbot.download_media(
-                msg,
-                file_name=download_path,
-                progress=progress_callback,
-                progress_args=(user_id, app, status_msg, "Downloading")
-            )
+            if flight:
+                file_path = await fetch_shared(flight, fetch, download_path)
+            else:
+                file_path = await fetch(download_path)
             
             if not file_path:
-                await status_msg.edit("❌ Failed to download media.")
+                await tg_call(status_msg.edit, "❌ Failed to download media.")
                 return
             
             # Prepare caption
@@ -246,7 +261,8 @@ async def save_restricted_content(event):
             thumb_path = thumbnail(user_id) or await screenshot(file_path, 0, user_id)
             
             # Upload the file
-            await status_msg.edit("📤 Uploading to Telegram...")
+            finish(status_msg.chat_id, status_msg.id)
+            await tg_call(status_msg.edit, "📤 Uploading to Telegram...")
             
             if msg.video:
                 # Get video metadata
@@ -255,49 +271,61 @@ async def save_restricted_content(event):
                 height = metadata.get('height', 0)
                 duration = metadata.get('duration', 0)
                 
-                # Upload with Telethon for better handling of large files
-                uploaded_file = await fast_upload(client, file_path, progress_callback=lambda d, t: progress_callback(d, t, user_id))
-                
-                # Send the video
-                await client.send_file(
-                    user_id,
-                    uploaded_file,
-                    thumb=thumb_path,
-                    caption=caption,
-                    supports_streaming=True,
-                    attributes=[
-                        DocumentAttributeVideo(
-                            duration=duration,
-                            w=width,
-                            h=height,
-                            supports_streaming=True
-                        )
-                    ]
-                )
+                async with slot('upload', user_id):
+                    # Upload with Telethon for better handling of large files
+                    uploaded_file = await fast_upload(client, file_path, progress_callback=lambda d, t: progress_callback(d, t, user_id, client, status_msg, "Uploading"))
+                    
+                    # Send the video
+                    await tg_call(client.send_file, 
+                        user_id,
+                        uploaded_file,
+                        thumb=thumb_path,
+                        caption=caption,
+                        supports_streaming=True,
+                        attributes=[
+                            DocumentAttributeVideo(
+                                duration=duration,
+                                w=width,
+                                h=height,
+                                supports_streaming=True
+                            )
+                        ]
+                    )
             else:
                 # For other types of media
-                await app.send_document(
-                    user_id,
-                    file_path,
-                    thumb=thumb_path,
-                    caption=caption,
-                    progress=progress_callback,
-                    progress_args=(user_id, app, status_msg, "Uploading")
-                )
+                async with slot('upload', user_id):
+                    await tg_call(app.send_document, 
+                        user_id,
+                        file_path,
+                        thumb=thumb_path,
+                        caption=caption,
+                        progress=progress_callback,
+                        progress_args=(user_id, app, status_msg, "Uploading")
+                    )
             
             # Delete status message and cleanup
+            finish(status_msg.chat_id, status_msg.id)
             await status_msg.delete()
-            if os.path.exists(file_path):
-                os.remove(file_path)
             if thumb_path and os.path.exists(thumb_path) and thumb_path != thumbnail(user_id):
                 os.remove(thumb_path)
                 
         except Exception as e:
-            await status_msg.edit(f"❌ Error processing media: {str(e)}")
+            finish(status_msg.chat_id, status_msg.id)
+            await tg_call(status_msg.edit, f"❌ Error processing media: {str(e)}")
             logger.error(f"Error in save_restricted_content: {str(e)}")
+        finally:
+            if file_path:
+                if flight:
+                    release_shared(flight)
+                if os.path.exists(file_path):
+                    os.remove(file_path)
+                try:
+                    os.rmdir(download_path)
+                except OSError:
+                    pass
             
     except Exception as e:
-        await status_msg.edit(f"❌ An error occurred: {str(e)}")
+        await tg_call(status_msg.edit, f"❌ An error occurred: {str(e)}")
         logger.error(f"Error in save_restricted_content: {str(e)}")
 
 # Run the plugin
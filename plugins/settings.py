@@ -10,7 +10,7 @@ import string
 import random
 from shared_client import client as gf
 from config import OWNER_ID
-from utils.func import get_user_data_key, save_user_data, users_collection
+from utils.func import get_user_data_key, save_user_data, update_user, get_user_settings
 
 VIDEO_EXTENSIONS = {
     'mp4', 'mkv', 'avi', 'mov', 'wmv', 'flv', 'webm',
@@ -95,26 +95,20 @@ __👉 **Note:** if you are using custom bot then your bot should be admin that
         action = callback_actions[event.data]
         await start_conversation(event, user_id, action['type'], action['message'])
     elif event.data == b'logout':
-        result = await users_collection.update_one(
-            {'user_id': user_id},
-            {'$unset': {'session_string': ''}}
-        )
+        result = await update_user(user_id, {'$unset': {'session_string': ''}})
         if result.modified_count > 0:
             await event.respond('Logged out and deleted session successfully.')
         else:
             await event.respond('You are not logged in.')
     elif event.data == b'reset':
         try:
-            await users_collection.update_one(
-                {'user_id': user_id},
-                {'$unset': {
-                    'delete_words': '',
-                    'replacement_words': '',
-                    'rename_tag': '',
-                    'caption': '',
-                    'chat_id': ''
-                }}
-            )
+            await update_user(user_id, {'$unset': {
+                'delete_words': '',
+                'replacement_words': '',
+                'rename_tag': '',
+                'caption': '',
+                'chat_id': ''
+            }})
             thumbnail_path = f'{user_id}.jpg'
             if os.path.exists(thumbnail_path):
                 os.remove(thumbnail_path)
@@ -230,40 +224,39 @@ def generate_random_name(length=7):
     return ''.join(random.choice(characters) for _ in range(length))
 
 
-async def rename_file(file, sender, edit):
-    try:
-        delete_words = await get_user_data_key(sender, 'delete_words', [])
-        custom_rename_tag = await get_user_data_key(sender, 'rename_tag', '')
-        replacements = await get_user_data_key(sender, 'replacement_words', {})
-        
-        last_dot_index = str(file).rfind('.')
-        if last_dot_index != -1 and last_dot_index != 0:
-            ggn_ext = str(file)[last_dot_index + 1:]
-            if ggn_ext.isalpha() and len(ggn_ext) <= 9:
-                if ggn_ext.lower() in VIDEO_EXTENSIONS:
-                    original_file_name = str(file)[:last_dot_index]
-                    file_extension = 'mp4'
-                else:
-                    original_file_name = str(file)[:last_dot_index]
-                    file_extension = ggn_ext
-            else:
-                original_file_name = str(file)[:last_dot_index]
+async def build_file_name(file, sender, settings=None):
+    settings = settings or await get_user_settings(sender)
+    custom_rename_tag = settings.rename_tag
+    # Rules apply to the file name only, never to the job directory it sits in
+    directory, name = os.path.split(str(file))
+    
+    last_dot_index = name.rfind('.')
+    if last_dot_index != -1 and last_dot_index != 0:
+        ggn_ext = name[last_dot_index + 1:]
+        if ggn_ext.isalpha() and len(ggn_ext) <= 9:
+            if ggn_ext.lower() in VIDEO_EXTENSIONS:
+                original_file_name = name[:last_dot_index]
                 file_extension = 'mp4'
+            else:
+                original_file_name = name[:last_dot_index]
+                file_extension = ggn_ext
         else:
-            original_file_name = str(file)
+            original_file_name = name[:last_dot_index]
             file_extension = 'mp4'
-        
-        for word in delete_words:
-            original_file_name = original_file_name.replace(word, '')
-        
-        for word, replace_word in replacements.items():
-            original_file_name = original_file_name.replace(word, replace_word)
-        
-        new_file_name = f'{original_file_name} {custom_rename_tag}.{file_extension}'
-        
+    else:
+        original_file_name = name
+        file_extension = 'mp4'
+    
+    original_file_name = settings.name_rules.apply(original_file_name)
+    
+    return os.path.join(directory, f'{original_file_name} {custom_rename_tag}.{file_extension}')
+
+
+async def rename_file(file, sender, edit, settings=None):
+    try:
+        new_file_name = await build_file_name(file, sender, settings)
         os.rename(file, new_file_name)
         return new_file_name
     except Exception as e:
         print(f"Rename error: {e}")
         return file
-        
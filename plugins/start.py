@@ -26,6 +26,9 @@ async def set(_, message):
     await app.set_bot_commands([
         BotCommand("start", "🚀 Start the bot"),
         BotCommand("batch", "🫠 Extract in bulk"),
+        BotCommand("scan", "🔎 Preview a batch range before running it"),
+        BotCommand("queue", "📋 List your queued batch jobs"),
+        BotCommand("dequeue", "🗑️ Drop a queued batch job"),
         BotCommand("login", "🔑 Get into the bot"),
         BotCommand("setbot", "🧸 Add your bot for handling files"),
         BotCommand("logout", "🚪 Get out of the bot"),
@@ -69,7 +72,7 @@ help_pages = [
         "8. **/login**\n"
         "> Log into the bot for private channel access\n\n"
         "9. **/batch**\n"
-        "> Bulk extraction for posts (After login)\n\n"
+        "> Bulk extraction for posts (After login). Use /scan first to preview sizes and ETA of a range\n\n"
     ),
     (
         "📝 **Bot Commands Overview (2/2)**:\n\n"
@@ -239,10 +242,10 @@ async def start_command(client, message):
         # Insert test data to verify database functionality
         test_id = f"test_{message.from_user.id}"
         test_collection = MONGO_DB["test_collection"]
-        test_collection.insert_one({"_id": test_id, "test": True})
-        db_status = "✅ Working" if test_collection.find_one({"_id": test_id}) else "⚠️ Issues detected"
+        await test_collection.update_one({"_id": test_id}, {"$set": {"test": True}}, upsert=True)
+        db_status = "✅ Working" if await test_collection.find_one({"_id": test_id}) else "⚠️ Issues detected"
         # Clean up test data
-        test_collection.delete_one({"_id": test_id})
+        await test_collection.delete_one({"_id": test_id})
     except Exception as e:
         logger.error(f"Database test error: {e}")
         db_status = "❌ Error detected"
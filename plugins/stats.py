@@ -5,8 +5,12 @@
 from datetime import timedelta, datetime
 from shared_client import client as bot_client
 from telethon import events
-from utils.func import get_premium_details, is_private_chat, get_display_name, get_user_data, premium_users_collection, is_premium_user
+from utils.func import get_premium_details, is_private_chat, get_display_name, get_user_data, premium_users_collection, is_premium_user, user_cache_metrics
 from config import OWNER_ID
+from plugins.batch import UB, UC
+from utils.scheduler import scheduler_metrics
+from utils.dedupe import dedupe_metrics
+from utils.peercache import peer_metrics
 import logging
 logging.basicConfig(format=
     '%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
@@ -43,10 +47,29 @@ async def status_handler(event):
         formatted_expiry = expiry_ist.strftime("%d-%b-%Y %I:%M:%S %p")
         premium_status = f"✅ Premium until {formatted_expiry} (IST)"
     
+    pool_status = ""
+    if user_id in OWNER_ID:
+        for name, pool in (('Bots', UB), ('User clients', UC)):
+            s = pool.metrics()
+            pool_status += (f"\n**{name}:** {s['size']} running ({s['busy']} busy), "
+                            f"{s['hits']} hits, {s['misses']} misses, {s['evictions']} evictions")
+        for kind, s in scheduler_metrics().items():
+            pool_status += (f"\n**{kind.title()}s:** {s['running']}/{s['limit']} running, "
+                            f"{s['waiting']} waiting, {s['users']} users")
+        s = dedupe_metrics()
+        pool_status += (f"\n**Dedupe cache:** {s['size']} files, {s['hits']} hits, "
+                        f"{s['misses']} misses, {s['evictions']} evictions")
+        s = peer_metrics()
+        pool_status += f"\n**Peer cache:** {s['peers']} peers, {s['hits']} hits, {s['misses']} misses"
+        s = user_cache_metrics()
+        pool_status += (f"\n**User cache:** {s['size']} users, {s['hits']} hits, "
+                        f"{s['misses']} misses, {s['evictions']} evictions")
+    
     await event.respond(
         "**Your current status:**\n\n"
         f"**Login Status:** {'✅ Active' if session_active else '❌ Inactive'}\n"
         f"**Premium:** {premium_status}"
+        f"{pool_status}"
     )
 
 @bot_client.on(events.NewMessage(pattern='/transfer'))
@@ -27,7 +27,10 @@ from shared_client import client, app
 from telethon import events
 from telethon.sync import TelegramClient
 from telethon.tl.types import DocumentAttributeVideo
-from utils.func import get_video_metadata, screenshot
+from utils.func import inspect_video, thumbnail
+from utils.ratelimit import tg_call
+from utils.scheduler import slot
+from utils.progress import report, finish
 from telethon.tl.functions.messages import EditMessageRequest
 from devgagantools import fast_upload
 from concurrent.futures import ThreadPoolExecutor
@@ -106,10 +109,11 @@ async def process_audio(client, event, url, cookies_env_var=None):
  
     try:
          
-        info_dict = await extract_audio_async(ydl_opts, url)
+        async with slot('download', event.sender_id):
+            info_dict = await extract_audio_async(ydl_opts, url)
         title = info_dict.get('title', 'Extracted Audio')
  
-        await progress_message.edit("**__Editing metadata...__**")
+        await tg_call(progress_message.edit, "**__Editing metadata...__**")
  
          
         if os.path.exists(download_path):
@@ -142,15 +146,17 @@ async def process_audio(client, event, url, cookies_env_var=None):
         chat_id = event.chat_id
         if os.path.exists(download_path):
             await progress_message.delete()
-            prog = await client.send_message(chat_id, "**__Starting Upload...__**")
-            uploaded = await fast_upload(
-                client, download_path, 
-                reply=prog, 
-                name=None,
-                progress_bar_function=lambda done, total: progress_callback(done, total, chat_id)
-            )
-            await client.send_file(chat_id, uploaded, caption=f"**{title}**\n\n**__Powered by Team SPY__**")
+            prog = await tg_call(client.send_message, chat_id, "**__Starting Upload...__**")
+            async with slot('upload', event.sender_id):
+                uploaded = await fast_upload(
+                    client, download_path, 
+                    reply=ReportedReply(prog), 
+                    name=None,
+                    progress_bar_function=lambda done, total: progress_callback(done, total, chat_id)
+                )
+                await tg_call(client.send_file, chat_id, uploaded, caption=f"**{title}**\n\n**__Powered by Team SPY__**")
             if prog:
+                finish(prog.chat_id, prog.id)
                 await prog.delete()
         else:
             await event.reply("**__Audio file not found after extraction!__**")
@@ -159,6 +165,7 @@ async def process_audio(client, event, url, cookies_env_var=None):
         logger.exception("Error during audio extraction or upload")
         await event.reply(f"**__An error occurred: {e}__**")
     finally:
+        user_progress.pop(event.chat_id, None)
         if os.path.exists(download_path):
             os.remove(download_path)
         if temp_cookie_path and os.path.exists(temp_cookie_path):
@@ -199,13 +206,13 @@ async def fetch_video_info(url, ydl_opts, progress_message, check_duration_and_s
              
             duration = info_dict.get('duration', 0)
             if duration and duration > 3 * 3600:   
-                await progress_message.edit("**❌ __Video is longer than 3 hours. Download aborted...__**")
+                await tg_call(progress_message.edit, "**❌ __Video is longer than 3 hours. Download aborted...__**")
                 return None
  
              
             estimated_size = info_dict.get('filesize_approx', 0)
             if estimated_size and estimated_size > 2 * 1024 * 1024 * 1024:   
-                await progress_message.edit("**🤞 __Video size is larger than 2GB. Aborting download.__**")
+                await tg_call(progress_message.edit, "**🤞 __Video size is larger than 2GB. Aborting download.__**")
                 return None
  
         return info_dict
@@ -250,6 +257,15 @@ async def handler(event):
  
 user_progress = {}
  
+class ReportedReply:
+    """Stands in for fast_upload's `reply`, so its progress edits go through report()."""
+
+    def __init__(self, message):
+        self.message = message
+
+    async def edit(self, text):
+        report(self.message.chat_id, self.message.id, self.message.edit, text)
+ 
 def progress_callback(done, total, user_id):
      
     if user_id not in user_progress:
@@ -281,6 +297,7 @@ def progress_callback(done, total, user_id):
         speed_bps = speed / elapsed_time   
         speed_mbps = (speed_bps * 8) / (1024 * 1024)   
     else:
+        speed_bps = 0
         speed_mbps = 0
  
      
@@ -309,6 +326,8 @@ def progress_callback(done, total, user_id):
      
     user_data['previous_done'] = done
     user_data['previous_time'] = time.time()
+    if done >= total:
+        user_progress.pop(user_id, None)
  
     return final
  
@@ -353,15 +372,9 @@ async def process_video(client, event, url, cookies_env_var, check_duration_and_
         if not info_dict:
             return
          
-        await asyncio.to_thread(download_video, url, ydl_opts)
+        async with slot('download', event.sender_id):
+            await asyncio.to_thread(download_video, url, ydl_opts)
         title = info_dict.get('title', 'Powered by Team SPY')
-        k = await get_video_metadata(download_path)      
-        W = k['width']
-        H = k['height']
-        D = k['duration']
-        metadata['width'] = info_dict.get('width') or W
-        metadata['height'] = info_dict.get('height') or H
-        metadata['duration'] = int(info_dict.get('duration') or 0) or D
         thumbnail_url = info_dict.get('thumbnail', None)
         THUMB = None
  
@@ -371,44 +384,50 @@ async def process_video(client, event, url, cookies_env_var, check_duration_and_
             downloaded_thumb = d_thumbnail(thumbnail_url, thumbnail_file)
             if downloaded_thumb:
                 logger.info(f"Thumbnail saved at: {downloaded_thumb}")
- 
-        if thumbnail_file:
-            THUMB = thumbnail_file
-        else:
-            THUMB = await screenshot(download_path, metadata['duration'], event.sender_id)
+                THUMB = downloaded_thumb
+ 
+        THUMB = THUMB or thumbnail(event.sender_id)
+        meta, shot = await inspect_video(download_path, info_dict, thumb=not THUMB)
+        metadata.update(meta)
+        if shot:
+            # Removed with the downloaded thumbnail once the upload is done
+            THUMB = thumbnail_file = shot
 
         chat_id = event.chat_id
         SIZE = 2 * 1024 * 1024
         caption = f"{title}"
      
         if os.path.exists(download_path) and os.path.getsize(download_path) > SIZE:
-            prog = await client.send_message(chat_id, "**__Starting Upload...__**")
-            await split_and_upload_file(app, chat_id, download_path, caption)
+            prog = await tg_call(client.send_message, chat_id, "**__Starting Upload...__**")
+            async with slot('upload', event.sender_id):
+                await split_and_upload_file(app, chat_id, download_path, caption)
             await prog.delete()
          
         if os.path.exists(download_path):
             await progress_message.delete()
-            prog = await client.send_message(chat_id, "**__Starting Upload...__**")
-            uploaded = await fast_upload(
-                client, download_path,
-                reply=prog,
-                progress_bar_function=lambda done, total: progress_callback(done, total, chat_id)
-            )
-            await client.send_file(
-                event.chat_id,
-                uploaded,
-                caption=f"**{title}**",
-                attributes=[
-                    DocumentAttributeVideo(
-                        duration=metadata['duration'],
-                        w=metadata['width'],
-                        h=metadata['height'],
-                        supports_streaming=True
-                    )
-                ],
-                thumb=THUMB if THUMB else None
-            )
+            prog = await tg_call(client.send_message, chat_id, "**__Starting Upload...__**")
+            async with slot('upload', event.sender_id):
+                uploaded = await fast_upload(
+                    client, download_path,
+                    reply=ReportedReply(prog),
+                    progress_bar_function=lambda done, total: progress_callback(done, total, chat_id)
+                )
+                await tg_call(client.send_file, 
+                    event.chat_id,
+                    uploaded,
+                    caption=f"**{title}**",
+                    attributes=[
+                        DocumentAttributeVideo(
+                            duration=metadata['duration'],
+                            w=metadata['width'],
+                            h=metadata['height'],
+                            supports_streaming=True
+                        )
+                    ],
+                    thumb=THUMB if THUMB else None
+                )
             if prog:
+                finish(prog.chat_id, prog.id)
                 await prog.delete()
         else:
             await event.reply("**__File not found after download. Something went wrong!__**")
@@ -416,7 +435,7 @@ async def process_video(client, event, url, cookies_env_var, check_duration_and_
         logger.exception("An error occurred during download or upload.")
         await event.reply(f"**__An error occurred: {e}__**")
     finally:
-         
+        user_progress.pop(event.chat_id, None)
         if os.path.exists(download_path):
             os.remove(download_path)
         if temp_cookie_path and os.path.exists(temp_cookie_path):
@@ -427,11 +446,11 @@ async def process_video(client, event, url, cookies_env_var, check_duration_and_
 
 async def split_and_upload_file(app, sender, file_path, caption):
     if not os.path.exists(file_path):
-        await app.send_message(sender, "❌ File not found!")
+        await tg_call(app.send_message, sender, "❌ File not found!")
         return
 
     file_size = os.path.getsize(file_path)
-    start = await app.send_message(sender, f"ℹ️ File size: {file_size / (1024 * 1024):.2f} MB")
+    start = await tg_call(app.send_message, sender, f"ℹ️ File size: {file_size / (1024 * 1024):.2f} MB")
     PART_SIZE =  1.9 * 1024 * 1024 * 1024
 
     part_number = 0
@@ -450,12 +469,13 @@ async def split_and_upload_file(app, sender, file_path, caption):
                 await part_f.write(chunk)
 
             # Uploading part
-            edit = await app.send_message(sender, f"⬆️ Uploading part {part_number + 1}...")
+            edit = await tg_call(app.send_message, sender, f"⬆️ Uploading part {part_number + 1}...")
             part_caption = f"{caption} \n\n**Part : {part_number + 1}**"
-            await app.send_document(sender, document=part_file, caption=part_caption,
+            await tg_call(app.send_document, sender, document=part_file, caption=part_caption,
                 progress=progress_bar,
                 progress_args=("╭─────────────────────╮\n│      **__Pyro Uploader__**\n├─────────────────────", edit, time.time())
             )
+            finish(edit.chat.id, edit.id)
             await edit.delete()
             os.remove(part_file)
 
@@ -501,30 +521,26 @@ async def progress_bar(current: int, total: int, ud_type: str, message, start: f
     now = time.time()
     diff = now - start
     
-    if round(diff % 10) == 0 or current == total:
-        percentage = (current * 100) / total
-        speed = current / diff if diff else 0
-        elapsed_time = round(diff * 1000)
-        time_to_completion = round((total - current) / speed) * 1000 if speed else 0
-        estimated_total_time = elapsed_time + time_to_completion
+    percentage = (current * 100) / total
+    speed = current / diff if diff else 0
+    elapsed_time = round(diff * 1000)
+    time_to_completion = round((total - current) / speed) * 1000 if speed else 0
+    estimated_total_time = elapsed_time + time_to_completion
 
-        elapsed_time_str = TimeFormatter(elapsed_time)
-        estimated_total_time_str = TimeFormatter(estimated_total_time)
+    elapsed_time_str = TimeFormatter(elapsed_time)
+    estimated_total_time_str = TimeFormatter(estimated_total_time)
 
-        progress = "".join(["♦" for _ in range(math.floor(percentage / 10))]) + \
-                   "".join(["◇" for _ in range(10 - math.floor(percentage / 10))])
-        
-        progress_text = progress + PROGRESS_BAR.format(
-            round(percentage, 2),
-            humanbytes(current),
-            humanbytes(total),
-            humanbytes(speed),
-            estimated_total_time_str if estimated_total_time_str else "0 s"
-        )
-        try:
-            await message.edit(text=f"{ud_type}\n│ {progress_text}")
-        except:
-            pass
+    progress = "".join(["♦" for _ in range(math.floor(percentage / 10))]) + \
+               "".join(["◇" for _ in range(10 - math.floor(percentage / 10))])
+    
+    progress_text = progress + PROGRESS_BAR.format(
+        round(percentage, 2),
+        humanbytes(current),
+        humanbytes(total),
+        humanbytes(speed),
+        estimated_total_time_str if estimated_total_time_str else "0 s"
+    )
+    report(message.chat.id, message.id, message.edit_text, f"{ud_type}\n│ {progress_text}")
 
 def humanbytes(size: int) -> str:
     """
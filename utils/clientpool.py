@@ -0,0 +1,136 @@
+# Copyright (c) 2025 devgagan : https://github.com/devgaganin.  
+# Licensed under the GNU General Public License v3.0.  
+# See LICENSE file in the repository root for full license text.
+
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from config import CLIENT_POOL_SIZE, CLIENT_IDLE_TIMEOUT
+from utils.transfer import close_media_sessions
+
+logger = logging.getLogger(__name__)
+
+
+class ClientPool:
+    """Bounded, dict-like pool of started per-user Pyrogram clients.
+
+    Least recently used clients are stopped once the pool grows past
+    `max_size`, and any client unused for `idle_timeout` seconds is stopped
+    by a background reaper. Clients held with hold() are never evicted.
+    Evicted users simply get a fresh client on their next request.
+    """
+
+    def __init__(self, name, max_size=CLIENT_POOL_SIZE, idle_timeout=CLIENT_IDLE_TIMEOUT):
+        self.name = name
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.clients = OrderedDict()
+        self.last_used = {}
+        self.busy = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.reaper = None
+
+    def __contains__(self, uid):
+        return uid in self.clients
+
+    def __len__(self):
+        return len(self.clients)
+
+    def __getitem__(self, uid):
+        client = self.clients[uid]
+        self.touch(uid)
+        return client
+
+    def __setitem__(self, uid, client):
+        self.clients[uid] = client
+        self.touch(uid)
+        self.start_reaper()
+        if len(self.clients) > self.max_size:
+            asyncio.create_task(self.shrink())
+
+    def __delitem__(self, uid):
+        del self.clients[uid]
+        self.last_used.pop(uid, None)
+
+    def get(self, uid, default=None):
+        return self[uid] if uid in self.clients else default
+
+    def pop(self, uid, default=None):
+        if uid not in self.clients:
+            return default
+        client = self.clients[uid]
+        del self[uid]
+        return client
+
+    def touch(self, uid):
+        self.clients.move_to_end(uid)
+        self.last_used[uid] = time.monotonic()
+
+    def lookup(self, uid):
+        """get(), but counted towards the pool's hit/miss metrics."""
+        client = self.get(uid)
+        if client:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return client
+
+    @asynccontextmanager
+    async def hold(self, uid):
+        """Keep uid's client from being evicted while the block runs."""
+        self.busy[uid] = self.busy.get(uid, 0) + 1
+        try:
+            yield
+        finally:
+            self.busy[uid] -= 1
+            if not self.busy[uid]:
+                del self.busy[uid]
+            if uid in self.clients:
+                self.touch(uid)
+
+    async def discard(self, uid):
+        """Drop uid's client from the pool and stop it."""
+        client = self.pop(uid)
+        if client:
+            try:
+                await close_media_sessions(client)
+                await client.stop()
+            except Exception as e:
+                logger.warning(f"Error stopping {self.name} client for user {uid}: {e}")
+
+    async def evict(self, uid, reason):
+        self.evictions += 1
+        logger.info(f"Evicting {reason} {self.name} client for user {uid} ({len(self.clients) - 1} left)")
+        await self.discard(uid)
+
+    async def shrink(self):
+        for uid in list(self.clients):
+            if len(self.clients) <= self.max_size:
+                break
+            if uid not in self.busy:
+                await self.evict(uid, 'least recently used')
+
+    async def reap(self):
+        while True:
+            await asyncio.sleep(max(1, self.idle_timeout / 4))
+            cutoff = time.monotonic() - self.idle_timeout
+            for uid in list(self.clients):
+                if uid not in self.busy and self.last_used.get(uid, 0) < cutoff:
+                    await self.evict(uid, 'idle')
+
+    def start_reaper(self):
+        if self.idle_timeout > 0 and (not self.reaper or self.reaper.done()):
+            self.reaper = asyncio.create_task(self.reap())
+
+    def metrics(self):
+        return {
+            'size': len(self.clients),
+            'busy': len(self.busy),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
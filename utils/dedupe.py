@@ -0,0 +1,56 @@
+# Copyright (c) 2025 devgagan : https://github.com/devgaganin.  
+# Licensed under the GNU General Public License v3.0.  
+# See LICENSE file in the repository root for full license text.
+
+from collections import OrderedDict
+from config import DEDUPE_CACHE_SIZE
+from utils.persist import JsonFile
+
+
+# "<bot id>:<source file_unique_id>:<destination chat>:<variant>" -> {"file_id": ..., "msg_id": ...}
+# file_ids are only valid for the bot that uploaded them, hence the bot id in the key.
+# The variant fingerprints whatever was baked into the upload (file name, thumbnail).
+DEDUPE_STATE = {'hits': 0, 'misses': 0, 'evictions': 0}
+DEDUPE_FILE = JsonFile("dedupe_cache.json", lambda: list(DEDUPE_CACHE.items()))
+DEDUPE_CACHE = OrderedDict(DEDUPE_FILE.load([]))
+
+
+def dedupe_key(c, file_unique_id, chat_id, variant=''):
+    me = getattr(c, 'me', None)
+    return f"{me.id if me else 0}:{file_unique_id}:{chat_id}:{variant}"
+
+
+def lookup_upload(c, file_unique_id, chat_id, variant=''):
+    """Return what was sent last time this source file went to chat_id as `variant`, or None."""
+    key = dedupe_key(c, file_unique_id, chat_id, variant)
+    entry = DEDUPE_CACHE.get(key)
+    if entry is None:
+        DEDUPE_STATE['misses'] += 1
+        return None
+    DEDUPE_STATE['hits'] += 1
+    DEDUPE_CACHE.move_to_end(key)
+    return entry
+
+
+def remember_upload(c, file_unique_id, chat_id, file_id, msg_id=None, variant=''):
+    key = dedupe_key(c, file_unique_id, chat_id, variant)
+    DEDUPE_CACHE[key] = {'file_id': file_id, 'msg_id': msg_id}
+    DEDUPE_CACHE.move_to_end(key)
+    while len(DEDUPE_CACHE) > DEDUPE_CACHE_SIZE:
+        DEDUPE_CACHE.popitem(last=False)
+        DEDUPE_STATE['evictions'] += 1
+    DEDUPE_FILE.mark_dirty()
+
+
+def forget_upload(c, file_unique_id, chat_id, variant=''):
+    if DEDUPE_CACHE.pop(dedupe_key(c, file_unique_id, chat_id, variant), None):
+        DEDUPE_FILE.mark_dirty()
+
+
+def dedupe_metrics():
+    return {
+        'size': len(DEDUPE_CACHE),
+        'hits': DEDUPE_STATE['hits'],
+        'misses': DEDUPE_STATE['misses'],
+        'evictions': DEDUPE_STATE['evictions'],
+    }
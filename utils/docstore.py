@@ -0,0 +1,357 @@
+# Copyright (c) 2025 devgagan : https://github.com/devgaganin.  
+# Licensed under the GNU General Public License v3.0.  
+# See LICENSE file in the repository root for full license text.
+
+import re
+import copy
+import json
+import uuid
+import sqlite3
+import asyncio
+import logging
+from functools import partial
+from datetime import datetime, timedelta
+from typing import Any, NamedTuple
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# The subset of the Mongo collection API the bot uses: find_one, insert_one,
+# update_one ($set / $unset / $inc, upsert), delete_one and create_index with
+# expireAfterSeconds. Queries are equality matches on top-level fields.
+UPDATE_OPERATORS = ('$set', '$unset', '$inc')
+
+
+class InsertOneResult(NamedTuple):
+    inserted_id: Any
+
+
+class UpdateResult(NamedTuple):
+    matched_count: int
+    modified_count: int
+    upserted_id: Any
+
+
+class DeleteResult(NamedTuple):
+    deleted_count: int
+
+
+def matches(doc, query):
+    return all(k in doc and doc[k] == v for k, v in query.items())
+
+
+def check_update(update):
+    unknown = set(update) - set(UPDATE_OPERATORS)
+    if unknown:
+        raise ValueError(f"Unsupported update operators: {', '.join(sorted(unknown))}")
+
+
+def apply_update(doc, update):
+    """Apply a checked update to doc in place and return whether anything changed."""
+    changed = False
+    for key, value in update.get('$set', {}).items():
+        if key not in doc or doc[key] != value:
+            doc[key] = copy.deepcopy(value)
+            changed = True
+    for key in update.get('$unset', {}):
+        if key in doc:
+            del doc[key]
+            changed = True
+    for key, value in update.get('$inc', {}).items():
+        doc[key] = doc.get(key, 0) + value
+        changed = True
+    return changed
+
+
+def upsert_doc(query, update):
+    doc = {k: copy.deepcopy(v) for k, v in query.items()}
+    apply_update(doc, update)
+    doc.setdefault('_id', uuid.uuid4().hex)
+    return doc
+
+
+def expired(doc, ttl):
+    """Whether a TTL index ({field: seconds}) has expired doc, as MongoDB would."""
+    now = datetime.now()
+    for field, seconds in ttl.items():
+        value = doc.get(field)
+        if isinstance(value, datetime) and value + timedelta(seconds=seconds) <= now:
+            return True
+    return False
+
+
+def index_field(keys):
+    return keys if isinstance(keys, str) else keys[0][0]
+
+
+class MemoryCollection:
+    """A collection kept in a dict, with user_id indexed.
+
+    No method awaits between reading and writing, so every call is atomic
+    on the event loop without any lock.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.docs = {}
+        self.by_user = {}
+        self.ttl = {}
+
+    def _add(self, doc):
+        self.docs[doc['_id']] = doc
+        if 'user_id' in doc:
+            self.by_user.setdefault(doc['user_id'], set()).add(doc['_id'])
+
+    def _remove(self, doc):
+        del self.docs[doc['_id']]
+        self._unindex(doc)
+
+    def _unindex(self, doc):
+        ids = self.by_user.get(doc.get('user_id'))
+        if ids:
+            ids.discard(doc['_id'])
+            if not ids:
+                del self.by_user[doc['user_id']]
+
+    def _first(self, query):
+        if '_id' in query:
+            ids = [query['_id']] if query['_id'] in self.docs else []
+        elif 'user_id' in query:
+            ids = list(self.by_user.get(query['user_id'], ()))
+        else:
+            ids = list(self.docs)
+        for _id in ids:
+            doc = self.docs[_id]
+            if self.ttl and expired(doc, self.ttl):
+                self._remove(doc)
+            elif matches(doc, query):
+                return doc
+        return None
+
+    async def find_one(self, query=None):
+        return copy.deepcopy(self._first(query or {}))
+
+    async def insert_one(self, doc):
+        doc = copy.deepcopy(doc)
+        doc.setdefault('_id', uuid.uuid4().hex)
+        if doc['_id'] in self.docs:
+            raise ValueError(f"Duplicate _id {doc['_id']!r} in {self.name}")
+        self._add(doc)
+        return InsertOneResult(doc['_id'])
+
+    async def update_one(self, query, update, upsert=False):
+        check_update(update)
+        doc = self._first(query)
+        if doc is None:
+            if not upsert:
+                return UpdateResult(0, 0, None)
+            doc = upsert_doc(query, update)
+            self._add(doc)
+            return UpdateResult(0, 0, doc['_id'])
+        self._unindex(doc)
+        changed = apply_update(doc, update)
+        self._add(doc)
+        return UpdateResult(1, int(changed), None)
+
+    async def delete_one(self, query):
+        doc = self._first(query)
+        if doc is None:
+            return DeleteResult(0)
+        self._remove(doc)
+        return DeleteResult(1)
+
+    async def create_index(self, keys, expireAfterSeconds=None, **kwargs):
+        field = index_field(keys)
+        if expireAfterSeconds is not None:
+            self.ttl[field] = expireAfterSeconds
+        return f'{field}_1'
+
+
+class MemoryDatabase:
+    """Collections that live only as long as the process."""
+
+    def __init__(self):
+        self.collections = {}
+
+    def __getitem__(self, name):
+        if name not in self.collections:
+            self.collections[name] = MemoryCollection(name)
+        return self.collections[name]
+
+
+def encode_value(value):
+    if isinstance(value, datetime):
+        return {'$date': value.isoformat()}
+    raise TypeError(f'{type(value).__name__} is not storable')
+
+
+def decode_object(obj):
+    if len(obj) == 1 and '$date' in obj:
+        return datetime.fromisoformat(obj['$date'])
+    return obj
+
+
+dumps = partial(json.dumps, default=encode_value)
+loads = partial(json.loads, object_hook=decode_object)
+
+
+class SQLiteCollection:
+    """A collection stored as JSON documents in one SQLite table, with user_id indexed.
+
+    Every method runs its whole read-modify-write on the database's single
+    worker thread, so calls never block the event loop and never interleave.
+    """
+
+    def __init__(self, db, name):
+        if not re.fullmatch(r'\w+', name):
+            raise ValueError(f'Bad collection name {name!r}')
+        self.db = db
+        self.name = name
+        self.ttl = None
+
+    def _conn(self):
+        conn = self.db.connect()
+        if self.ttl is None:
+            conn.execute(f'CREATE TABLE IF NOT EXISTS "{self.name}" (_id TEXT PRIMARY KEY, user_id, doc TEXT NOT NULL)')
+            conn.execute(f'CREATE INDEX IF NOT EXISTS "{self.name}_user_id" ON "{self.name}" (user_id)')
+            self.ttl = dict(conn.execute('SELECT field, seconds FROM _ttl WHERE collection = ?', (self.name,)).fetchall())
+        return conn
+
+    def _first(self, conn, query):
+        if '_id' in query:
+            rows = conn.execute(f'SELECT doc FROM "{self.name}" WHERE _id = ?', (dumps(query['_id']),))
+        elif 'user_id' in query:
+            rows = conn.execute(f'SELECT doc FROM "{self.name}" WHERE user_id = ?', (query['user_id'],))
+        else:
+            rows = conn.execute(f'SELECT doc FROM "{self.name}"')
+        for (raw,) in rows.fetchall():
+            doc = loads(raw)
+            if self.ttl and expired(doc, self.ttl):
+                conn.execute(f'DELETE FROM "{self.name}" WHERE _id = ?', (dumps(doc['_id']),))
+            elif matches(doc, query):
+                return doc
+        return None
+
+    def _save(self, conn, doc):
+        conn.execute(f'INSERT OR REPLACE INTO "{self.name}" (_id, user_id, doc) VALUES (?, ?, ?)',
+                     (dumps(doc['_id']), doc.get('user_id'), dumps(doc)))
+
+    def _find_one(self, query):
+        conn = self._conn()
+        with self.db.transaction(conn):
+            return self._first(conn, query)
+
+    def _insert_one(self, doc):
+        conn = self._conn()
+        doc = dict(doc)
+        doc.setdefault('_id', uuid.uuid4().hex)
+        with self.db.transaction(conn):
+            conn.execute(f'INSERT INTO "{self.name}" (_id, user_id, doc) VALUES (?, ?, ?)',
+                         (dumps(doc['_id']), doc.get('user_id'), dumps(doc)))
+        return InsertOneResult(doc['_id'])
+
+    def _update_one(self, query, update, upsert):
+        check_update(update)
+        conn = self._conn()
+        with self.db.transaction(conn):
+            doc = self._first(conn, query)
+            if doc is None:
+                if not upsert:
+                    return UpdateResult(0, 0, None)
+                doc = upsert_doc(query, update)
+                self._save(conn, doc)
+                return UpdateResult(0, 0, doc['_id'])
+            changed = apply_update(doc, update)
+            if changed:
+                self._save(conn, doc)
+            return UpdateResult(1, int(changed), None)
+
+    def _delete_one(self, query):
+        conn = self._conn()
+        with self.db.transaction(conn):
+            doc = self._first(conn, query)
+            if doc is None:
+                return DeleteResult(0)
+            conn.execute(f'DELETE FROM "{self.name}" WHERE _id = ?', (dumps(doc['_id']),))
+            return DeleteResult(1)
+
+    def _create_index(self, field, seconds):
+        conn = self._conn()
+        if seconds is not None:
+            conn.execute('INSERT OR REPLACE INTO _ttl (collection, field, seconds) VALUES (?, ?, ?)',
+                         (self.name, field, seconds))
+            self.ttl[field] = seconds
+        return f'{field}_1'
+
+    async def find_one(self, query=None):
+        return await self.db.run(self._find_one, query or {})
+
+    async def insert_one(self, doc):
+        return await self.db.run(self._insert_one, doc)
+
+    async def update_one(self, query, update, upsert=False):
+        return await self.db.run(self._update_one, query, update, upsert)
+
+    async def delete_one(self, query):
+        return await self.db.run(self._delete_one, query)
+
+    async def create_index(self, keys, expireAfterSeconds=None, **kwargs):
+        return await self.db.run(self._create_index, index_field(keys), expireAfterSeconds)
+
+
+class SQLiteTransaction:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute('BEGIN IMMEDIATE')
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.execute('ROLLBACK' if exc_type else 'COMMIT')
+
+
+class SQLiteDatabase:
+    """Collections persisted in an SQLite file in WAL mode, served by one worker thread."""
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = None
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='docstore')
+        self.collections = {}
+
+    def connect(self):
+        if self.conn is None:
+            conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS _ttl (collection TEXT, field TEXT, seconds INTEGER, '
+                         'PRIMARY KEY (collection, field))')
+            self.conn = conn
+        return self.conn
+
+    def transaction(self, conn):
+        return SQLiteTransaction(conn)
+
+    async def run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+
+    def __getitem__(self, name):
+        if name not in self.collections:
+            self.collections[name] = SQLiteCollection(self, name)
+        return self.collections[name]
+
+
+def open_database(engine, uri=None, name='telegram_downloader', path='bot_data.db'):
+    """Return the database for DB_ENGINE: 'mongo' (motor), 'sqlite' or 'memory'."""
+    if engine == 'mongo':
+        try:
+            from motor.motor_asyncio import AsyncIOMotorClient
+            return AsyncIOMotorClient(uri)[name]
+        except ImportError:
+            logger.warning("motor is not installed, falling back to the SQLite database")
+            engine = 'sqlite'
+    if engine == 'sqlite':
+        return SQLiteDatabase(path)
+    if engine == 'memory':
+        return MemoryDatabase()
+    raise ValueError(f"Unknown DB_ENGINE {engine!r}, expected 'mongo', 'sqlite' or 'memory'")
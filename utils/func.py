@@ -3,14 +3,20 @@
 # See LICENSE file in the repository root for full license text.
 
 import concurrent.futures
+import copy
 import time
 import os
+import uuid
 import re
 import cv2
 import logging
 import asyncio
 from datetime import datetime, timedelta
-from config import MONGO_DB
+from collections import OrderedDict
+from functools import lru_cache
+from typing import NamedTuple, Optional
+from config import MONGO_DB, USER_CACHE_SIZE, USER_CACHE_TTL, PROBE_WORKERS, FFMPEG_TIMEOUT, FFMPEG_CONCURRENCY
+from utils.docstore import apply_update
 
 logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -100,25 +106,74 @@ async def is_private_chat(event):
     return event.is_private
 
 
+# user_id -> (loaded at, document or None). Every write to users_collection
+# goes through update_user, which applies it here as well, so reads never
+# need the store until the entry ages out after USER_CACHE_TTL.
+USER_CACHE = OrderedDict()
+USER_CACHE_STATE = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+
+def cache_user(user_id, doc):
+    USER_CACHE[user_id] = (time.monotonic(), doc)
+    USER_CACHE.move_to_end(user_id)
+    while len(USER_CACHE) > USER_CACHE_SIZE:
+        USER_CACHE.popitem(last=False)
+        USER_CACHE_STATE['evictions'] += 1
+
+
+async def load_user(user_id):
+    """Return the user's document from the cache, reading the store on a miss."""
+    user_id = int(user_id)
+    entry = USER_CACHE.get(user_id)
+    if entry and time.monotonic() - entry[0] < USER_CACHE_TTL:
+        USER_CACHE_STATE['hits'] += 1
+        USER_CACHE.move_to_end(user_id)
+        return entry[1]
+    USER_CACHE_STATE['misses'] += 1
+    version = settings_versions.get(user_id, 0)
+    doc = await users_collection.find_one({"user_id": user_id})
+    # A write that landed while we were reading may not be in doc
+    if settings_versions.get(user_id, 0) == version:
+        cache_user(user_id, doc)
+    return doc
+
+
+async def update_user(user_id, update, upsert=False):
+    """update_one on the user's document, applied to the cached copy as well."""
+    user_id = int(user_id)
+    version = bump_settings_version(user_id)
+    try:
+        result = await users_collection.update_one({"user_id": user_id}, update, upsert=upsert)
+    except Exception:
+        USER_CACHE.pop(user_id, None)
+        raise
+    entry = USER_CACHE.get(user_id)
+    if entry and entry[1] is not None and settings_versions[user_id] == version:
+        apply_update(entry[1], update)
+    else:
+        # Upserted documents get their _id from the store, and overlapping
+        # writes may have reached it in another order, so read it back
+        USER_CACHE.pop(user_id, None)
+    bump_settings_version(user_id)
+    return result
+
+
+def user_cache_metrics():
+    return {'size': len(USER_CACHE), **{k: USER_CACHE_STATE[k] for k in ('hits', 'misses', 'evictions')}}
+
+
 async def save_user_data(user_id, key, value):
-    await users_collection.update_one(
-        {"user_id": user_id},
-        {"$set": {key: value}},
-        upsert=True
-    )
-    print(users_collection)
+    await update_user(user_id, {"$set": {key: value}}, upsert=True)
 
 
 async def get_user_data_key(user_id, key, default=None):
-    user_data = await users_collection.find_one({"user_id": int(user_id)})
-    print(f"Fetching key '{key}' for user {user_id}: {user_data}")
-    return user_data.get(key, default) if user_data else default
+    user_data = await load_user(user_id)
+    return copy.deepcopy(user_data.get(key, default)) if user_data else default
 
 
 async def get_user_data(user_id):
     try:
-        user_data = await users_collection.find_one({"user_id": user_id})
-        return user_data
+        return copy.deepcopy(await load_user(user_id))
     except Exception as e:
         logger.error(f"Error retrieving user data for {user_id}: {e}")
         return None
@@ -126,14 +181,10 @@ async def get_user_data(user_id):
 
 async def save_user_session(user_id, session_string):
     try:
-        await users_collection.update_one(
-            {"user_id": user_id},
-            {"$set": {
-                "session_string": session_string,
-                "updated_at": datetime.now()
-            }},
-            upsert=True
-        )
+        await update_user(user_id, {"$set": {
+            "session_string": session_string,
+            "updated_at": datetime.now()
+        }}, upsert=True)
         logger.info(f"Saved session for user {user_id}")
         return True
     except Exception as e:
@@ -143,10 +194,7 @@ async def save_user_session(user_id, session_string):
 
 async def remove_user_session(user_id):
     try:
-        await users_collection.update_one(
-            {"user_id": user_id},
-            {"$unset": {"session_string": ""}}
-        )
+        await update_user(user_id, {"$unset": {"session_string": ""}})
         logger.info(f"Removed session for user {user_id}")
         return True
     except Exception as e:
@@ -156,14 +204,10 @@ async def remove_user_session(user_id):
 
 async def save_user_bot(user_id, bot_token):
     try:
-        await users_collection.update_one(
-            {"user_id": user_id},
-            {"$set": {
-                "bot_token": bot_token,
-                "updated_at": datetime.now()
-            }},
-            upsert=True
-        )
+        await update_user(user_id, {"$set": {
+            "bot_token": bot_token,
+            "updated_at": datetime.now()
+        }}, upsert=True)
         logger.info(f"Saved bot token for user {user_id}")
         return True
     except Exception as e:
@@ -173,10 +217,7 @@ async def save_user_bot(user_id, bot_token):
 
 async def remove_user_bot(user_id):
     try:
-        await users_collection.update_one(
-            {"user_id": user_id},
-            {"$unset": {"bot_token": ""}}
-        )
+        await update_user(user_id, {"$unset": {"bot_token": ""}})
         logger.info(f"Removed bot token for user {user_id}")
         return True
     except Exception as e:
@@ -184,96 +225,307 @@ async def remove_user_bot(user_id):
         return False
 
 
+# Distinct rule sets kept compiled; a user's rules only recompile when they change
+RULES_CACHE_SIZE = 1024
+
+
+def trie_pattern(words):
+    """Regex matching any of words, built as a prefix trie so each position costs one walk."""
+    trie = {}
+    for word in words:
+        node = trie
+        for ch in word:
+            node = node.setdefault(ch, {})
+        node[''] = {}
+
+    def build(node):
+        alts = [re.escape(ch) + build(child) for ch, child in sorted(node.items()) if ch]
+        if not alts:
+            return ''
+        body = alts[0] if len(alts) == 1 else f"(?:{'|'.join(alts)})"
+        # Greedy optional tail: the longest word wins, shorter ones on backtrack
+        return f'(?:{body})?' if '' in node else body
+
+    return build(trie)
+
+
+class TextRules(NamedTuple):
+    """Replacement and delete words compiled into one regex, applied in a single scan."""
+    regex: Optional[re.Pattern]
+    table: dict
+
+    def apply(self, text):
+        if not self.regex or not text:
+            return text
+        return self.regex.sub(self._substitute, text)
+
+    def _substitute(self, m):
+        if m.lastgroup == 'replace':
+            return self.table[m.group(0)]
+        # A deleted word takes the spaces on one side with it, never line breaks
+        return m.group('pre') if m.group('pre') and m.group('post') else ''
+
+
+@lru_cache(maxsize=RULES_CACHE_SIZE)
+def compile_caption_rules(delete_words, replacements):
+    """Delete whole whitespace-separated words and replace substrings everywhere else."""
+    table = {word: new for word, new in replacements if word}
+    branches = []
+    delete_words = [w for w in delete_words if w and not any(ch.isspace() for ch in w)]
+    if delete_words:
+        branches.append(rf'(?P<pre>[^\S\n]*)(?<!\S)(?P<delete>{trie_pattern(delete_words)})(?!\S)(?P<post>[^\S\n]*)')
+    if table:
+        branches.append(f'(?P<replace>{trie_pattern(table)})')
+    return TextRules(re.compile('|'.join(branches)) if branches else None, table)
+
+
+@lru_cache(maxsize=RULES_CACHE_SIZE)
+def compile_name_rules(delete_words, replacements):
+    """Delete or replace substrings of a file name; deleting wins when a word is in both lists."""
+    table = {word: new for word, new in replacements if word}
+    table.update((word, '') for word in delete_words if word)
+    return TextRules(re.compile(f'(?P<replace>{trie_pattern(table)})') if table else None, table)
+
+
+settings_versions = {}
+
+
+def bump_settings_version(user_id):
+    """Signal running batches that this user's settings changed."""
+    settings_versions[int(user_id)] = settings_versions.get(int(user_id), 0) + 1
+    return settings_versions[int(user_id)]
+
+
+class UserSettings(NamedTuple):
+    """Read-only view of a user's transfer settings, loaded once per batch."""
+    chat_id: Optional[str]
+    caption: str
+    rename_tag: str
+    delete_words: tuple
+    replacements: tuple
+    version: int
+    caption_rules: TextRules
+    name_rules: TextRules
+
+    @classmethod
+    def from_data(cls, user_id, data):
+        data = data or {}
+        delete_words = tuple(data.get('delete_words') or ())
+        replacements = tuple((data.get('replacement_words') or {}).items())
+        return cls(
+            chat_id=data.get('chat_id'),
+            caption=data.get('caption') or '',
+            rename_tag=data.get('rename_tag') or '',
+            delete_words=delete_words,
+            replacements=replacements,
+            version=settings_versions.get(int(user_id), 0),
+            caption_rules=compile_caption_rules(delete_words, replacements),
+            name_rules=compile_name_rules(delete_words, replacements)
+        )
+
+    def snapshot(self):
+        return {
+            'chat_id': self.chat_id,
+            'caption': self.caption,
+            'rename_tag': self.rename_tag,
+            'delete_words': list(self.delete_words),
+            'replacement_words': dict(self.replacements)
+        }
+
+    def is_stale(self, user_id):
+        return settings_versions.get(int(user_id), 0) != self.version
+
+
+async def get_user_settings(user_id):
+    return UserSettings.from_data(user_id, await get_user_data(int(user_id)))
+
+
+def apply_text_rules(settings, text):
+    if not text:
+        return ""
+    return settings.caption_rules.apply(text)
+
+
 async def process_text_with_rules(user_id, text):
     if not text:
         return ""
     
     try:
-        replacements = await get_user_data_key(user_id, "replacement_words", {})
-        delete_words = await get_user_data_key(user_id, "delete_words", [])
-        
-        processed_text = text
-        for word, replacement in replacements.items():
-            processed_text = processed_text.replace(word, replacement)
-        
-        if delete_words:
-            words = processed_text.split()
-            filtered_words = [w for w in words if w not in delete_words]
-            processed_text = " ".join(filtered_words)
-        
-        return processed_text
+        return apply_text_rules(await get_user_settings(user_id), text)
     except Exception as e:
         logger.error(f"Error processing text with rules: {e}")
         return text
 
 
 async def screenshot(video: str, duration: int, sender: str) -> str | None:
-    existing_screenshot = f"{sender}.jpg"
-    if os.path.exists(existing_screenshot):
+    existing_screenshot = thumbnail(sender)
+    if existing_screenshot:
         return existing_screenshot
+    _, thumb = await inspect_video(video, {'duration': duration})
+    return thumb
 
-    time_stamp = hhmmss(duration // 2)
-    output_file = datetime.now().isoformat("_", "seconds") + ".jpg"
-
-    cmd = [
-        "ffmpeg",
-        "-ss", time_stamp,
-        "-i", video,
-        "-frames:v", "1",
-        output_file,
-        "-y"
-    ]
-
-    process = await asyncio.create_subprocess_exec(
-        *cmd,
-        stdout=asyncio.subprocess.PIPE,
-        stderr=asyncio.subprocess.PIPE
-    )
-    
-    stdout, stderr = await process.communicate()
 
-    if os.path.isfile(output_file):
-        return output_file
-    else:
-        print(f"FFmpeg Error: {stderr.decode().strip()}")
-        return None
+# One pool for every probe, so a burst of uploads cannot open unbounded captures
+PROBE_EXECUTOR = concurrent.futures.ThreadPoolExecutor(max_workers=PROBE_WORKERS, thread_name_prefix='probe')
+# (device, inode, size, mtime) -> metadata. Keyed by inode so hard-linked
+# copies of one shared download and renamed files are only probed once.
+PROBE_CACHE = OrderedDict()
+PROBE_CACHE_SIZE = 512
+META_KEYS = ('width', 'height', 'duration')
+
+
+def known_metadata(source):
+    """The width/height/duration set on a pyrogram media object or a yt-dlp info_dict."""
+    if source is None:
+        return {}
+    get = source.get if isinstance(source, dict) else lambda key: getattr(source, key, None)
+    values = ((key, get(key)) for key in META_KEYS)
+    return {key: round(v) for key, v in values if isinstance(v, (int, float)) and v > 0}
+
+
+def probe_key(file_path):
+    st = os.stat(file_path)
+    return (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+
 
+def cached_probe(key):
+    if key in PROBE_CACHE:
+        PROBE_CACHE.move_to_end(key)
+        return PROBE_CACHE[key]
+    return None
 
-async def get_video_metadata(file_path):
+
+def cache_probe(key, meta):
+    if not meta or len(meta) < len(META_KEYS):
+        return
+    PROBE_CACHE[key] = meta
+    while len(PROBE_CACHE) > PROBE_CACHE_SIZE:
+        PROBE_CACHE.popitem(last=False)
+
+
+def probe_video(file_path):
+    vcap = cv2.VideoCapture(file_path)
+    try:
+        if not vcap.isOpened():
+            return None
+        width = round(vcap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        height = round(vcap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        fps = vcap.get(cv2.CAP_PROP_FPS)
+        frame_count = vcap.get(cv2.CAP_PROP_FRAME_COUNT)
+        if fps <= 0:
+            return None
+        duration = round(frame_count / fps)
+        if duration <= 0:
+            return None
+        return {'width': width, 'height': height, 'duration': duration}
+    finally:
+        vcap.release()
+
+
+async def get_video_metadata(file_path, known=None):
+    """Return width, height and duration of a video, without probing when `known` already has them.
+
+    `known` may be the source message's video (m.video) or a yt-dlp info_dict;
+    any of its values win over probed ones.
+    """
     default_values = {'width': 1, 'height': 1, 'duration': 1}
-    loop = asyncio.get_event_loop()
-    executor = concurrent.futures.ThreadPoolExecutor(max_workers=4)
-    
+    known = known_metadata(known)
+    if len(known) == len(META_KEYS):
+        return known
+
     try:
-        def _extract_metadata():
-            try:
-                vcap = cv2.VideoCapture(file_path)
-                if not vcap.isOpened():
-                    return default_values
-
-                width = round(vcap.get(cv2.CAP_PROP_FRAME_WIDTH))
-                height = round(vcap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-                fps = vcap.get(cv2.CAP_PROP_FPS)
-                frame_count = vcap.get(cv2.CAP_PROP_FRAME_COUNT)
-
-                if fps <= 0:
-                    return default_values
-
-                duration = round(frame_count / fps)
-                if duration <= 0:
-                    return default_values
-
-                vcap.release()
-                return {'width': width, 'height': height, 'duration': duration}
-            except Exception as e:
-                logger.error(f"Error in video_metadata: {e}")
-                return default_values
-        
-        return await loop.run_in_executor(executor, _extract_metadata)
-        
+        key = probe_key(file_path)
+        meta = cached_probe(key)
+        if not meta:
+            meta = await asyncio.get_running_loop().run_in_executor(PROBE_EXECUTOR, probe_video, file_path)
+            cache_probe(key, meta)
     except Exception as e:
         logger.error(f"Error in get_video_metadata: {e}")
-        return default_values
+        meta = None
+    return {**(meta or default_values), **known}
+
+
+# Caps ffmpeg processes across all users; each one decodes at full speed on a core
+FFMPEG_SLOTS = asyncio.Semaphore(FFMPEG_CONCURRENCY)
+THUMB_SIZE = 320  # Telegram shows thumbnails no larger than 320px on either side
+DURATION_PATTERN = re.compile(r'Duration: (\d+):(\d\d):(\d\d(?:\.\d+)?)')
+VIDEO_STREAM_PATTERN = re.compile(r'Stream #.*?: Video: .*?, (\d{2,5})x(\d{2,5})[\s,]')
+ROTATION_PATTERN = re.compile(r'rotat(?:e\s*:\s*|ion of )(-?\d+)')
+
+
+def parse_ffmpeg_info(stderr):
+    """width/height/duration from the input summary ffmpeg prints to stderr."""
+    meta = {}
+    m = DURATION_PATTERN.search(stderr)
+    if m:
+        meta['duration'] = round(int(m[1]) * 3600 + int(m[2]) * 60 + float(m[3]))
+    m = VIDEO_STREAM_PATTERN.search(stderr)
+    if m:
+        width, height = int(m[1]), int(m[2])
+        rotation = ROTATION_PATTERN.search(stderr)
+        if rotation and abs(int(rotation[1])) % 180 == 90:
+            width, height = height, width
+        meta.update(width=width, height=height)
+    return {key: v for key, v in meta.items() if v > 0}
+
+
+async def run_ffmpeg(*args):
+    """Run ffmpeg under FFMPEG_SLOTS, killing it after FFMPEG_TIMEOUT; return its stderr."""
+    async with FFMPEG_SLOTS:
+        process = await asyncio.create_subprocess_exec(
+            "ffmpeg", "-hide_banner", "-nostdin", *args,
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.PIPE
+        )
+        try:
+            _, stderr = await asyncio.wait_for(process.communicate(), FFMPEG_TIMEOUT)
+        except BaseException:
+            if process.returncode is None:
+                process.kill()
+                await process.wait()
+            raise
+        return stderr.decode(errors='replace')
+
+
+async def inspect_video(file_path, known=None, thumb=True):
+    """Return (metadata, thumbnail) for a video from a single ffmpeg run.
+
+    The thumbnail is a new, uniquely named JPEG next to the video, scaled to
+    fit THUMB_SIZE, which the caller must delete; it is None when thumb is
+    False or ffmpeg could not produce one. `known` is as for get_video_metadata.
+    """
+    if not thumb:
+        return await get_video_metadata(file_path, known), None
+    known = known_metadata(known)
+    output_file = os.path.join(os.path.dirname(file_path), f"thumb_{uuid.uuid4().hex}.jpg")
+    scale = f"scale={THUMB_SIZE}:{THUMB_SIZE}:force_original_aspect_ratio=decrease"
+    stderr = ''
+    try:
+        key = probe_key(file_path)
+        duration = known.get('duration') or (cached_probe(key) or {}).get('duration')
+        if duration:
+            # Input seeking jumps straight to the middle instead of decoding up to it
+            cmd = ["-ss", str(duration / 2), "-i", file_path, "-vf", scale]
+        else:
+            # Pick the most representative of the first frames, which are often black
+            cmd = ["-i", file_path, "-vf", f"thumbnail=50,{scale}"]
+        stderr = await run_ffmpeg(*cmd, "-map", "0:v:0", "-frames:v", "1", "-q:v", "4", "-y", output_file)
+        cache_probe(key, parse_ffmpeg_info(stderr))
+    except asyncio.TimeoutError:
+        logger.warning(f"ffmpeg timed out after {FFMPEG_TIMEOUT}s on {file_path}")
+    except Exception as e:
+        logger.error(f"Error in inspect_video: {e}")
+
+    if os.path.isfile(output_file) and os.path.getsize(output_file):
+        thumb_path = output_file
+    else:
+        thumb_path = None
+        if os.path.exists(output_file):
+            os.remove(output_file)
+        if stderr:
+            logger.warning(f"FFmpeg Error: {stderr.strip().splitlines()[-1]}")
+    # Served from the cache when ffmpeg reported everything, else probed
+    return await get_video_metadata(file_path, known), thumb_path
 
 
 async def add_premium_user(user_id, duration_value, duration_unit):
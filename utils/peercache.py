@@ -0,0 +1,61 @@
+# Copyright (c) 2025 devgagan : https://github.com/devgaganin.  
+# Licensed under the GNU General Public License v3.0.  
+# See LICENSE file in the repository root for full license text.
+
+from pyrogram import raw
+from utils.persist import JsonFile
+
+
+# "<client user id>" -> {"<chat as given in the link>": [peer id, access hash, peer type, chat id to use]}
+# Session-string clients keep peers in memory only, so without this every
+# restart (and every new pool client) had to scan dialogs again.
+PEER_STATE = {'hits': 0, 'misses': 0}
+PEER_FILE = JsonFile("peer_cache.json", lambda: {k: dict(v) for k, v in PEER_CACHE.items()})
+PEER_CACHE = PEER_FILE.load({})
+
+
+def client_key(c):
+    me = getattr(c, 'me', None)
+    return str(me.id) if me else None
+
+
+async def cached_chat(c, chat):
+    """Return the chat id stored for `chat`, after teaching the client its access hash."""
+    entry = PEER_CACHE.get(client_key(c), {}).get(str(chat))
+    if not entry:
+        PEER_STATE['misses'] += 1
+        return None
+    PEER_STATE['hits'] += 1
+    peer_id, access_hash, peer_type, chat_id = entry
+    await c.storage.update_peers([(peer_id, access_hash, peer_type, None, None)])
+    return chat_id
+
+
+def remember_peer(c, chat, peer, chat_id):
+    """Store the InputPeer `chat` resolved to on client c."""
+    key = client_key(c)
+    if not key:
+        return
+    if isinstance(peer, raw.types.InputPeerChannel):
+        entry = [int(f'-100{peer.channel_id}'), peer.access_hash, 'channel', chat_id]
+    elif isinstance(peer, raw.types.InputPeerChat):
+        entry = [-peer.chat_id, 0, 'group', chat_id]
+    elif isinstance(peer, raw.types.InputPeerUser):
+        entry = [peer.user_id, peer.access_hash, 'user', chat_id]
+    else:
+        return
+    PEER_CACHE.setdefault(key, {})[str(chat)] = entry
+    PEER_FILE.mark_dirty()
+
+
+def forget_peer(c, chat):
+    if PEER_CACHE.get(client_key(c), {}).pop(str(chat), None):
+        PEER_FILE.mark_dirty()
+
+
+def peer_metrics():
+    return {
+        'peers': sum(len(v) for v in PEER_CACHE.values()),
+        'hits': PEER_STATE['hits'],
+        'misses': PEER_STATE['misses'],
+    }
@@ -0,0 +1,62 @@
+# Copyright (c) 2025 devgagan : https://github.com/devgaganin.  
+# Licensed under the GNU General Public License v3.0.  
+# See LICENSE file in the repository root for full license text.
+
+import os
+import json
+import asyncio
+import logging
+from config import CACHE_FLUSH_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+
+class JsonFile:
+    """A JSON file rewritten in the background after changes, at most every `interval` seconds.
+
+    `snapshot()` is called on the event loop and must return a copy of the
+    data that is safe to serialise from a worker thread. Writes go through a
+    temporary file and os.replace, so a crash never leaves half a file.
+    """
+
+    def __init__(self, path, snapshot, interval=CACHE_FLUSH_INTERVAL):
+        self.path = path
+        self.snapshot = snapshot
+        self.interval = interval
+        self.dirty = False
+        self.writer = None
+
+    def load(self, default):
+        try:
+            if os.path.exists(self.path):
+                with open(self.path, 'r') as f:
+                    return json.load(f)
+        except Exception as e:
+            logger.warning(f"Could not load {self.path}: {e}")
+        return default
+
+    def write(self, data):
+        tmp = f"{self.path}.tmp"
+        with open(tmp, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp, self.path)
+
+    async def run_writer(self):
+        try:
+            while self.dirty:
+                await asyncio.sleep(self.interval)
+                self.dirty = False
+                try:
+                    await asyncio.to_thread(self.write, self.snapshot())
+                except Exception as e:
+                    self.dirty = True
+                    logger.error(f"Error saving {self.path}: {e}")
+        except asyncio.CancelledError:
+            if self.dirty:
+                self.write(self.snapshot())
+            raise
+
+    def mark_dirty(self):
+        self.dirty = True
+        if not self.writer or self.writer.done():
+            self.writer = asyncio.create_task(self.run_writer())
@@ -0,0 +1,92 @@
+# Copyright (c) 2025 devgagan : https://github.com/devgaganin.  
+# Licensed under the GNU General Public License v3.0.  
+# See LICENSE file in the repository root for full license text.
+
+import time
+import asyncio
+import logging
+from pyrogram.errors import FloodWait
+from telethon.errors import FloodWaitError
+from utils.ratelimit import flood_seconds
+from config import PROGRESS_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+
+# (chat_id, message_id) -> latest text not yet shown, and the task showing it
+_pending = {}
+_senders = {}
+# chat_id -> monotonic time before which that chat must not be edited again
+_next_edit = {}
+
+
+def report(chat_id, message_id, edit, text):
+    """Show `text` on a status message, at most once per PROGRESS_INTERVAL per chat.
+
+    `edit` is an async callable taking the new text. Calls made while the
+    chat is throttled only replace the pending text, so a burst of progress
+    callbacks costs a single edit with the latest state. FloodWait pushes
+    the chat's next edit back instead of retrying in place.
+    """
+    key = (chat_id, message_id)
+    _pending[key] = (edit, text)
+    if key not in _senders:
+        now = time.monotonic()
+        for chat in [c for c, t in _next_edit.items() if t <= now]:
+            del _next_edit[chat]
+        _senders[key] = asyncio.create_task(_send_latest(key))
+
+
+def finish(chat_id, message_id):
+    """Drop anything still queued for a status message, e.g. before deleting it."""
+    key = (chat_id, message_id)
+    _pending.pop(key, None)
+    task = _senders.pop(key, None)
+    if task and task is not asyncio.current_task():
+        task.cancel()
+
+
+async def _send_latest(key):
+    chat_id = key[0]
+    last = None
+    try:
+        while key in _pending:
+            wait = _next_edit.get(chat_id, 0) - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+            edit, text = _pending.pop(key)
+            if text == last:
+                continue
+            _next_edit[chat_id] = time.monotonic() + PROGRESS_INTERVAL
+            try:
+                await edit(text)
+                last = text
+            except (FloodWait, FloodWaitError) as e:
+                _next_edit[chat_id] = time.monotonic() + flood_seconds(e)
+                _pending.setdefault(key, (edit, text))
+            except Exception as e:
+                logger.debug(f"Progress edit failed for {key}: {e}")
+    finally:
+        if _senders.get(key) is asyncio.current_task():
+            del _senders[key]
+
+
+def transfer_text(current, total, start, title="Pyro Handler..."):
+    p = current / total * 100 if total else 0
+    bar = '🟢' * int(p / 10) + '🔴' * (10 - int(p / 10))
+    speed = current / (time.time() - start) / (1024 * 1024) if time.time() > start else 0
+    eta = time.strftime('%M:%S', time.gmtime((total - current) / (speed * 1024 * 1024))) if speed > 0 else '00:00'
+    return (f"__**{title}**__\n\n{bar}\n\n⚡**__Completed__**: {current / (1024 * 1024):.2f} MB / "
+            f"{total / (1024 * 1024):.2f} MB\n📊 **__Done__**: {p:.2f}%\n🚀 **__Speed__**: {speed:.2f} MB/s\n"
+            f"⏳ **__ETA__**: {eta}\n\n**__Powered by Team SPY__**")
+
+
+async def progress_callback(current, total, user_id, client=None, message=None, action="Transferring", start=None):
+    """Progress callback reporting onto a Pyrogram or Telethon `message` through report()."""
+    if not message:
+        return
+    chat_id = getattr(message, 'chat_id', None) or message.chat.id
+    edit = getattr(message, 'edit_text', None) or message.edit
+    start = start or message.date.timestamp()
+    report(chat_id, message.id, edit, transfer_text(current, total, start, f"{action}..."))
@@ -0,0 +1,102 @@
+# Copyright (c) 2025 devgagan : https://github.com/devgaganin.  
+# Licensed under the GNU General Public License v3.0.  
+# See LICENSE file in the repository root for full license text.
+
+import time
+import asyncio
+import logging
+import weakref
+from pyrogram.errors import FloodWait
+from telethon.errors import FloodWaitError
+from config import FLOOD_RETRIES
+
+logger = logging.getLogger(__name__)
+
+# Starting (and ceiling) calls per second for each method, per client.
+# Buckets slow down on every FloodWait and creep back up on success.
+RATES = {
+    'send_message': 1.0, 'send_video': 1.0, 'send_document': 1.0, 'send_photo': 1.0,
+    'send_audio': 1.0, 'send_voice': 1.0, 'send_video_note': 1.0, 'send_sticker': 1.0,
+    'copy_message': 1.0, 'invoke': 1.0, 'send_file': 1.0, 'reply': 1.0, 'reply_text': 1.0,
+    'edit_message_text': 0.5, 'edit': 0.5,
+    'get_messages': 3.0, 'get_chat': 2.0, 'join_chat': 0.2,
+}
+DEFAULT_RATE = 2.0
+MIN_RATE = 0.02
+
+
+class TokenBucket:
+    def __init__(self, rate):
+        self.max_rate = rate
+        self.rate = rate
+        self.tokens = 1.0
+        self.stamp = time.monotonic()
+        self.blocked_until = 0.0
+        self.floods = 0
+        self.lock = asyncio.Lock()
+
+    def delay(self):
+        now = time.monotonic()
+        self.tokens = min(max(1.0, self.rate), self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        return 0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                wait = self.delay()
+                if wait <= 0:
+                    break
+                await asyncio.sleep(wait)
+            self.tokens -= 1
+
+    def on_success(self):
+        self.rate = min(self.max_rate, self.rate + self.max_rate / 50)
+
+    def on_flood(self, seconds):
+        self.floods += 1
+        self.tokens = 0
+        self.rate = max(MIN_RATE, self.rate / 2)
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+
+_buckets = weakref.WeakKeyDictionary()
+
+
+def get_bucket(client, name):
+    per_client = _buckets.setdefault(client, {})
+    if name not in per_client:
+        per_client[name] = TokenBucket(RATES.get(name, DEFAULT_RATE))
+    return per_client[name]
+
+
+def _bucket_for(fn):
+    owner = fn.__self__
+    return get_bucket(getattr(owner, '_client', None) or owner, fn.__name__)
+
+
+def flood_seconds(e):
+    return e.value if isinstance(e, FloodWait) else e.seconds
+
+
+async def tg_call(fn, *args, **kwargs):
+    """Await a bound Telegram client/message method through its rate bucket.
+
+    FloodWait is honoured: the bucket is blocked for the requested time, its
+    rate halved, and the call retried up to FLOOD_RETRIES times.
+    """
+    bucket = _bucket_for(fn)
+    for attempt in range(FLOOD_RETRIES + 1):
+        await bucket.acquire()
+        try:
+            result = await fn(*args, **kwargs)
+            bucket.on_success()
+            return result
+        except (FloodWait, FloodWaitError) as e:
+            wait = flood_seconds(e)
+            bucket.on_flood(wait)
+            if attempt == FLOOD_RETRIES:
+                raise
+            logger.warning(f"FloodWait of {wait}s on {fn.__name__}, rate now {bucket.rate:.2f}/s")
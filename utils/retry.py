@@ -0,0 +1,66 @@
+# Copyright (c) 2025 devgagan : https://github.com/devgaganin.  
+# Licensed under the GNU General Public License v3.0.  
+# See LICENSE file in the repository root for full license text.
+
+import random
+import asyncio
+import logging
+from pyrogram.errors import (
+    FloodWait, FileReferenceExpired, FileReferenceInvalid, SeeOther, InternalServerError, ServiceUnavailable
+)
+from utils.ratelimit import flood_seconds
+from config import TRANSFER_RETRIES, RETRY_BASE_DELAY
+
+logger = logging.getLogger(__name__)
+
+MAX_DELAY = 60
+
+
+class PartNotSaved(Exception):
+    """The server answered False to an upload part; sending it again normally succeeds."""
+
+
+def classify(e):
+    """Sort a transfer error into 'flood', 'expired', 'migrate', 'timeout' or 'permanent'."""
+    if isinstance(e, FloodWait):
+        return 'flood'
+    if isinstance(e, (FileReferenceExpired, FileReferenceInvalid)) or 'FILE_REFERENCE_' in str(e):
+        return 'expired'
+    if isinstance(e, SeeOther):
+        return 'migrate'
+    if isinstance(e, (asyncio.TimeoutError, TimeoutError, ConnectionError, InternalServerError, ServiceUnavailable, PartNotSaved)):
+        return 'timeout'
+    return 'permanent'
+
+
+def backoff(attempt):
+    return min(MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt) * random.uniform(0.8, 1.2)
+
+
+async def with_retries(fn, refresh=None, label='transfer'):
+    """Await fn() again after transient failures, up to TRANSFER_RETRIES times.
+
+    Timeouts and server errors back off exponentially, FloodWait sleeps
+    for the time asked, DC migrations retry at once and an expired file
+    reference first awaits refresh() to fetch a fresh one. Permanent
+    errors, and expired references without `refresh`, are raised at once.
+    `fn` takes no arguments, so it sees whatever refresh() replaced.
+    """
+    for attempt in range(TRANSFER_RETRIES + 1):
+        try:
+            return await fn()
+        except Exception as e:
+            kind = classify(e)
+            if kind == 'permanent' or (kind == 'expired' and not refresh) or attempt == TRANSFER_RETRIES:
+                raise
+            if kind == 'expired':
+                await refresh()
+                wait = 0
+            elif kind == 'flood':
+                wait = flood_seconds(e)
+            elif kind == 'migrate':
+                wait = 0
+            else:
+                wait = backoff(attempt)
+            logger.warning(f"{label} failed ({kind}: {e}), retry {attempt + 1}/{TRANSFER_RETRIES} in {wait:.0f}s")
+            await asyncio.sleep(wait)
@@ -0,0 +1,96 @@
+# Copyright (c) 2025 devgagan : https://github.com/devgaganin.  
+# Licensed under the GNU General Public License v3.0.  
+# See LICENSE file in the repository root for full license text.
+
+import asyncio
+import logging
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from config import MAX_DOWNLOADS, MAX_UPLOADS
+
+logger = logging.getLogger(__name__)
+
+
+class FairSlots:
+    """A process-wide pool of `limit` transfer slots shared fairly between users.
+
+    Each user waits in their own FIFO queue and a freed slot goes to the
+    next user in round-robin order, so one user with a thousand queued
+    files cannot starve another user's single /save.
+    """
+
+    def __init__(self, name, limit):
+        self.name = name
+        self.limit = limit
+        self.free = limit
+        self.queues = OrderedDict()
+        self.running = {}
+
+    async def acquire(self, uid):
+        if self.free > 0 and not self.queues:
+            self.free -= 1
+        else:
+            fut = asyncio.get_running_loop().create_future()
+            self.queues.setdefault(uid, deque()).append(fut)
+            try:
+                await fut
+            except asyncio.CancelledError:
+                if fut.done() and not fut.cancelled():
+                    self.release()
+                raise
+        self.running[uid] = self.running.get(uid, 0) + 1
+
+    def release(self, uid=None):
+        if uid is not None:
+            self.running[uid] -= 1
+            if not self.running[uid]:
+                del self.running[uid]
+        while self.queues:
+            user, waiters = next(iter(self.queues.items()))
+            fut = waiters.popleft()
+            if waiters:
+                self.queues.move_to_end(user)
+            else:
+                del self.queues[user]
+            if not fut.done():
+                fut.set_result(None)
+                return
+        self.free += 1
+
+    def waiting(self):
+        return sum(1 for waiters in self.queues.values() for fut in waiters if not fut.done())
+
+    def metrics(self):
+        return {
+            'limit': self.limit,
+            'running': self.limit - self.free,
+            'waiting': self.waiting(),
+            'users': len(self.running),
+        }
+
+
+SLOTS = {
+    'download': FairSlots('download', MAX_DOWNLOADS),
+    'upload': FairSlots('upload', MAX_UPLOADS),
+}
+
+
+@asynccontextmanager
+async def slot(kind, uid):
+    """Run the block while holding one of the global `kind` slots on behalf of uid.
+
+    Every transfer (batch, /single, /save, /dl, /adl) goes through here, so
+    the whole process never has more than MAX_DOWNLOADS downloads and
+    MAX_UPLOADS uploads running, however many users are active.
+    """
+    slots = SLOTS[kind]
+    uid = int(uid)
+    await slots.acquire(uid)
+    try:
+        yield
+    finally:
+        slots.release(uid)
+
+
+def scheduler_metrics():
+    return {kind: slots.metrics() for kind, slots in SLOTS.items()}
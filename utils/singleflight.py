@@ -0,0 +1,69 @@
+# Copyright (c) 2025 devgagan : https://github.com/devgaganin.  
+# Licensed under the GNU General Public License v3.0.  
+# See LICENSE file in the repository root for full license text.
+
+import os
+import shutil
+import asyncio
+
+
+SHARED_DIR = os.path.join('downloads', 'shared')
+
+# (numeric chat id, message id, file_unique_id) -> {'task': download task, 'refs': holders}
+_flights = {}
+
+
+def flight_key(msg, media):
+    """Key a source file on the resolved numeric chat id, never on how the link spelled it."""
+    return (msg.chat.id, msg.id, media.file_unique_id)
+
+
+def shared_dir(key):
+    return os.path.join(SHARED_DIR, '_'.join(str(k) for k in key), '')
+
+
+async def fetch_shared(key, fetch, dest_dir):
+    """Download a source file once for every concurrent request of it.
+
+    The first caller runs `fetch(dir)`, which must download into `dir` and
+    return the file path (or None). Callers arriving while the file is
+    downloading or still held wait for the same download. Each caller gets
+    its own hard link in `dest_dir`, so renames and cleanup stay per job,
+    and must call release_shared(key) once its upload is finished.
+    """
+    flight = _flights.get(key)
+    if not flight:
+        flight = _flights[key] = {'task': asyncio.ensure_future(fetch(shared_dir(key))), 'refs': 0}
+    flight['refs'] += 1
+    try:
+        path = await asyncio.shield(flight['task'])
+        if not path:
+            release_shared(key)
+            return None
+        os.makedirs(dest_dir, exist_ok=True)
+        own = os.path.join(dest_dir, os.path.basename(path))
+        try:
+            os.link(path, own)
+        except OSError:
+            await asyncio.to_thread(shutil.copyfile, path, own)
+        return own
+    except BaseException:
+        release_shared(key)
+        raise
+
+
+def release_shared(key):
+    flight = _flights.get(key)
+    if not flight:
+        return
+    flight['refs'] -= 1
+    if flight['refs'] > 0:
+        return
+    del _flights[key]
+    if not flight['task'].done():
+        flight['task'].cancel()
+    shutil.rmtree(shared_dir(key), ignore_errors=True)
+
+
+def shared_downloads():
+    return {'files': len(_flights), 'holders': sum(f['refs'] for f in _flights.values())}
@@ -0,0 +1,418 @@
+# Copyright (c) 2025 devgagan : https://github.com/devgaganin.  
+# Licensed under the GNU General Public License v3.0.  
+# See LICENSE file in the repository root for full license text.
+
+import os
+import math
+import asyncio
+import hashlib
+import logging
+import mimetypes
+from pyrogram import raw, types
+from pyrogram.file_id import FileId, FileType
+from pyrogram.session import Session
+from pyrogram.session.auth import Auth
+from pyrogram.utils import parse_text_entities, parse_messages
+from utils.ratelimit import tg_call
+from utils.retry import classify, with_retries, PartNotSaved
+from config import RELAY_WINDOW, DOWNLOAD_CONNECTIONS
+
+logger = logging.getLogger(__name__)
+
+
+PART_SIZE = 512 * 1024
+RELAY_WORKERS = 2
+CHUNK_SIZE = 1024 * 1024
+PARALLEL_MIN_SIZE = 20 * 1024 * 1024
+
+
+def source_media(m):
+    for kind in ('video', 'video_note', 'voice', 'audio', 'photo', 'document'):
+        media = getattr(m, kind, None)
+        if media:
+            return kind, media
+    return None, None
+
+
+def media_file_name(m, kind, media):
+    name = getattr(media, 'file_name', None)
+    if not name:
+        ext = '.jpg' if kind == 'photo' else mimetypes.guess_extension(getattr(media, 'mime_type', '') or '') or ''
+        name = f'{kind}_{m.id}{ext}'
+    return name
+
+
+# client -> {dc_id: {'lock', 'auth_key', 'authorized', 'sessions'}}. Kept open
+# across files like Pyrogram's own media_sessions: authorizing a foreign DC
+# takes a new auth key plus Export/ImportAuthorization, which Telegram limits.
+MEDIA_SESSIONS = {}
+
+
+async def media_sessions(c, dc_id, count):
+    """Return `count` started media sessions to dc_id, opening only those not cached yet."""
+    entry = MEDIA_SESSIONS.setdefault(c, {}).setdefault(
+        dc_id, {'lock': asyncio.Lock(), 'auth_key': None, 'authorized': False, 'sessions': []})
+    async with entry['lock']:
+        home, test_mode = await c.storage.dc_id(), await c.storage.test_mode()
+        if entry['auth_key'] is None:
+            entry['auth_key'] = await c.storage.auth_key() if dc_id == home else await Auth(c, dc_id, test_mode).create()
+        while len(entry['sessions']) < count:
+            session = Session(c, dc_id, entry['auth_key'], test_mode, is_media=True)
+            await session.start()
+            try:
+                if dc_id != home and not entry['authorized']:
+                    exported = await c.invoke(raw.functions.auth.ExportAuthorization(dc_id=dc_id))
+                    await session.invoke(raw.functions.auth.ImportAuthorization(id=exported.id, bytes=exported.bytes))
+                    entry['authorized'] = True
+            except Exception:
+                await session.stop()
+                raise
+            entry['sessions'].append(session)
+        return entry['sessions'][:count]
+
+
+async def close_media_sessions(c, dc_id=None):
+    """Stop the cached media sessions of client c, for one DC or all of them."""
+    entries = MEDIA_SESSIONS.get(c, {})
+    for dc in [dc_id] if dc_id is not None else list(entries):
+        entry = entries.pop(dc, None)
+        for session in entry['sessions'] if entry else ():
+            try:
+                await session.stop()
+            except Exception as e:
+                logger.warning(f"Error stopping media session to DC {dc}: {e}")
+    if not entries:
+        MEDIA_SESSIONS.pop(c, None)
+
+
+async def save_part(session, rpc):
+    """Send one SaveFilePart/SaveBigFilePart, retrying it while the server reports it unsaved."""
+    async def attempt():
+        if not await session.invoke(rpc):
+            raise PartNotSaved(f'part {rpc.file_part} was not saved')
+    await with_retries(attempt, label=f'upload of part {rpc.file_part}')
+
+
+def write_at(f, offset, data):
+    f.seek(offset)
+    f.write(data)
+
+
+def read_at(f, offset, size):
+    f.seek(offset)
+    return f.read(size)
+
+
+def file_md5(path):
+    md5 = hashlib.md5()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            md5.update(block)
+    return md5.hexdigest()
+
+
+async def parallel_download(c, media, path, connections=DOWNLOAD_CONNECTIONS, progress=None, progress_args=(), resume=None):
+    """Download `media` to `path` over several connections to its DC at once.
+
+    The file is preallocated and every 1 MB part is written at its own
+    offset as soon as it arrives, whichever connection fetched it.
+    Parts written are recorded in resume['parts'], so calling again with
+    the same `resume` dict only fetches the parts still missing.
+    """
+    file_id = FileId.decode(media.file_id)
+    size = media.file_size
+    if file_id.file_type == FileType.PHOTO:
+        location = raw.types.InputPhotoFileLocation(
+            id=file_id.media_id, access_hash=file_id.access_hash,
+            file_reference=file_id.file_reference, thumb_size=file_id.thumbnail_size)
+    else:
+        location = raw.types.InputDocumentFileLocation(
+            id=file_id.media_id, access_hash=file_id.access_hash,
+            file_reference=file_id.file_reference, thumb_size=file_id.thumbnail_size)
+    parts = max(1, math.ceil(size / CHUNK_SIZE))
+    done = set() if resume is None else resume.setdefault('parts', set())
+    if not done or not os.path.exists(path) or os.path.getsize(path) != size:
+        done.clear()
+        with open(path, 'wb') as f:
+            f.truncate(size)
+    todo = iter([n for n in range(parts) if n not in done])
+    state = {'done': sum(min(CHUNK_SIZE, size - n * CHUNK_SIZE) for n in done)}
+
+    async def worker(session):
+        with open(path, 'r+b') as f:
+            for n in todo:
+                r = await session.invoke(
+                    raw.functions.upload.GetFile(location=location, offset=n * CHUNK_SIZE, limit=CHUNK_SIZE),
+                    sleep_threshold=30)
+                if not isinstance(r, raw.types.upload.File):
+                    raise ValueError(f'unsupported GetFile result {type(r).__name__}')
+                if len(r.bytes) != min(CHUNK_SIZE, size - n * CHUNK_SIZE):
+                    raise ValueError(f'part {n} came back with {len(r.bytes)} bytes')
+                await asyncio.to_thread(write_at, f, n * CHUNK_SIZE, r.bytes)
+                done.add(n)
+                state['done'] += len(r.bytes)
+                if progress:
+                    await progress(min(state['done'], size), size, *progress_args)
+
+    sessions = await media_sessions(c, file_id.dc_id, max(1, min(connections, parts - len(done))))
+    tasks = [asyncio.create_task(worker(s)) for s in sessions]
+    try:
+        await asyncio.gather(*tasks)
+    except Exception as e:
+        if classify(e) == 'permanent':
+            # The sessions themselves may be broken; authorize afresh next time
+            await close_media_sessions(c, file_id.dc_id)
+        raise
+    finally:
+        for t in tasks:
+            t.cancel()
+    if len(done) != parts:
+        raise ValueError(f'parallel download got {len(done)} of {parts} parts')
+    return path
+
+
+async def download_media(c, m, directory, progress=None, progress_args=(), resume=None):
+    """Download the media of `m` into `directory` and return the file path.
+
+    Files of PARALLEL_MIN_SIZE and above use parallel_download(); anything
+    else, or a parallel download that fails for good, goes through Pyrogram.
+    With a `resume` dict, a transient failure of a parallel download is
+    raised with the partial file kept, and the next call continues it.
+    """
+    kind, media = source_media(m)
+    if media and DOWNLOAD_CONNECTIONS > 1 and (media.file_size or 0) >= PARALLEL_MIN_SIZE:
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, media_file_name(m, kind, media))
+        try:
+            return await parallel_download(c, media, path, progress=progress, progress_args=progress_args, resume=resume)
+        except Exception as e:
+            if resume is not None and classify(e) != 'permanent':
+                raise
+            logger.warning(f"Parallel download of message {m.id} failed, using a single stream: {e}")
+            if resume:
+                resume.clear()
+            if os.path.exists(path):
+                os.remove(path)
+    return await c.download_media(m, file_name=os.path.join(directory, ''), progress=progress, progress_args=progress_args)
+
+
+async def build_media(c, file, name, kind, meta=None, thumb=None):
+    """Wrap an uploaded InputFile into the InputMedia matching `kind`."""
+    meta = meta or {}
+    if kind == 'photo':
+        return raw.types.InputMediaUploadedPhoto(file=file)
+
+    th = await c.save_file(thumb) if thumb and kind in ('video', 'audio', 'document') else None
+    attrs = [raw.types.DocumentAttributeFilename(file_name=name)]
+    mime = c.guess_mime_type(name)
+
+    if kind == 'video':
+        attrs.insert(0, raw.types.DocumentAttributeVideo(
+            supports_streaming=True, duration=meta.get('duration') or 0,
+            w=meta.get('width') or 0, h=meta.get('height') or 0))
+        mime = mime or 'video/mp4'
+    elif kind == 'video_note':
+        attrs = [raw.types.DocumentAttributeVideo(
+            round_message=True, duration=meta.get('duration') or 0,
+            w=meta.get('length') or 1, h=meta.get('length') or 1)]
+        mime = 'video/mp4'
+    elif kind == 'voice':
+        attrs = [raw.types.DocumentAttributeAudio(voice=True, duration=meta.get('duration') or 0)]
+        mime = mime or 'audio/mpeg'
+    elif kind == 'audio':
+        attrs.insert(0, raw.types.DocumentAttributeAudio(
+            duration=meta.get('duration') or 0, performer=meta.get('performer'), title=meta.get('title')))
+        mime = mime or 'audio/mpeg'
+
+    return raw.types.InputMediaUploadedDocument(
+        mime_type=mime or 'application/zip', file=file, thumb=th, attributes=attrs)
+
+
+async def save_parts(c, path, resume=None, progress=None, progress_args=()):
+    """Upload a local file in PART_SIZE parts and return its InputFile.
+
+    Unlike Client.save_file() this raises when a part fails. Parts the
+    server accepted are recorded in `resume` with the upload's file id, so
+    calling again with the same dict only sends the missing parts.
+    """
+    size = os.path.getsize(path)
+    if not size:
+        raise ValueError('File size equals to 0 B')
+    is_big = size > 10 * 1024 * 1024
+    total = math.ceil(size / PART_SIZE)
+    resume = {} if resume is None else resume
+    file_id = resume.setdefault('file_id', c.rnd_id())
+    done = resume.setdefault('parts', set())
+    todo = iter([n for n in range(total) if n not in done])
+    state = {'sent': sum(min(PART_SIZE, size - n * PART_SIZE) for n in done)}
+
+    async def worker(session):
+        with open(path, 'rb') as f:
+            for n in todo:
+                data = await asyncio.to_thread(read_at, f, n * PART_SIZE, PART_SIZE)
+                if is_big:
+                    rpc = raw.functions.upload.SaveBigFilePart(file_id=file_id, file_part=n, file_total_parts=total, bytes=data)
+                else:
+                    rpc = raw.functions.upload.SaveFilePart(file_id=file_id, file_part=n, bytes=data)
+                await save_part(session, rpc)
+                done.add(n)
+                state['sent'] += len(data)
+                if progress:
+                    await progress(min(state['sent'], size), size, *progress_args)
+
+    session = Session(c, await c.storage.dc_id(), await c.storage.auth_key(), await c.storage.test_mode(), is_media=True)
+    await session.start()
+    tasks = [asyncio.create_task(worker(session)) for _ in range(4 if is_big else 1)]
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        for t in tasks:
+            t.cancel()
+        await session.stop()
+
+    name = os.path.basename(path)
+    if is_big:
+        return raw.types.InputFileBig(id=file_id, parts=total, name=name)
+    return raw.types.InputFile(id=file_id, parts=total, name=name, md5_checksum=await asyncio.to_thread(file_md5, path))
+
+
+async def upload_media(c, path, kind, meta=None, thumb=None, progress=None, progress_args=(), resume=None):
+    """Upload a local file and return the InputMedia, without sending any message.
+
+    Splitting the upload from the send lets several files transfer at once
+    while the messages are still posted in source order by send_uploaded().
+    `resume` is passed to save_parts(), so a retried upload continues.
+    """
+    file = await save_parts(c, path, resume, progress, progress_args)
+    return await build_media(c, file, os.path.basename(path), kind, meta, thumb)
+
+
+async def relay_media(c, u, m, size, name, kind, meta=None, thumb=None, progress=None, progress_args=()):
+    """Stream the media of `m` from client `u` straight into an upload on `c`.
+
+    Nothing is written to disk: downloaded chunks are cut into upload parts
+    and at most RELAY_WINDOW parts are held in memory at any time.
+    Returns the InputMedia, like upload_media().
+    """
+    is_big = size > 10 * 1024 * 1024
+    total = max(1, math.ceil(size / PART_SIZE))
+    file_id = c.rnd_id()
+    md5 = None if is_big else hashlib.md5()
+    parts = asyncio.Queue(RELAY_WINDOW)
+    state = {'sent': 0, 'parts': 0}
+
+    async def reader():
+        buf = bytearray()
+        async for chunk in u.stream_media(m):
+            buf += chunk
+            while len(buf) >= PART_SIZE:
+                await put(bytes(buf[:PART_SIZE]))
+                del buf[:PART_SIZE]
+        if buf or not state['parts']:
+            await put(bytes(buf))
+        for _ in range(RELAY_WORKERS):
+            await parts.put(None)
+
+    async def put(data):
+        if md5:
+            md5.update(data)
+        await parts.put((state['parts'], data))
+        state['parts'] += 1
+
+    async def writer(session):
+        while True:
+            item = await parts.get()
+            if item is None:
+                return
+            n, data = item
+            if is_big:
+                rpc = raw.functions.upload.SaveBigFilePart(file_id=file_id, file_part=n, file_total_parts=total, bytes=data)
+            else:
+                rpc = raw.functions.upload.SaveFilePart(file_id=file_id, file_part=n, bytes=data)
+            await save_part(session, rpc)
+            state['sent'] += len(data)
+            if progress:
+                await progress(min(state['sent'], size), size, *progress_args)
+
+    session = Session(c, await c.storage.dc_id(), await c.storage.auth_key(), await c.storage.test_mode(), is_media=True)
+    await session.start()
+    tasks = [asyncio.create_task(reader())] + [asyncio.create_task(writer(session)) for _ in range(RELAY_WORKERS)]
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        for t in tasks:
+            t.cancel()
+        await session.stop()
+
+    if state['parts'] != total:
+        raise ValueError(f"relay got {state['parts']} parts, expected {total}")
+    if is_big:
+        file = raw.types.InputFileBig(id=file_id, parts=total, name=name)
+    else:
+        file = raw.types.InputFile(id=file_id, parts=total, name=name, md5_checksum=md5.hexdigest())
+    return await build_media(c, file, name, kind, meta, thumb)
+
+
+async def send_album(c, chat_id, items, reply_to=None):
+    """Post several media returned by upload_media() as one album.
+
+    `items` is a list of (media, caption). Each file is first attached with
+    UploadMedia, then all of them go out in a single SendMultiMedia.
+    Returns the sent Messages.
+    """
+    peer = await c.resolve_peer(chat_id)
+    multi = []
+    for media, caption in items:
+        r = await tg_call(c.invoke, raw.functions.messages.UploadMedia(peer=peer, media=media))
+        if isinstance(r, raw.types.MessageMediaPhoto):
+            media = raw.types.InputMediaPhoto(id=raw.types.InputPhoto(
+                id=r.photo.id, access_hash=r.photo.access_hash, file_reference=r.photo.file_reference))
+        else:
+            media = raw.types.InputMediaDocument(id=raw.types.InputDocument(
+                id=r.document.id, access_hash=r.document.access_hash, file_reference=r.document.file_reference))
+        multi.append(raw.types.InputSingleMedia(
+            media=media, random_id=c.rnd_id(), **await parse_text_entities(c, caption or '', None, None)))
+    r = await tg_call(c.invoke, raw.functions.messages.SendMultiMedia(peer=peer, multi_media=multi, reply_to_msg_id=reply_to))
+    return await parse_messages(c, raw.types.messages.Messages(
+        messages=[u.message for u in r.updates
+                  if isinstance(u, (raw.types.UpdateNewMessage, raw.types.UpdateNewChannelMessage))],
+        users=r.users,
+        chats=r.chats
+    ))
+
+
+async def forward_plain(c, from_chat, ids, chat_id, top_msg_id=None):
+    """Forward up to 100 messages without the "forwarded from" header, in one call."""
+    await tg_call(
+        c.invoke,
+        raw.functions.messages.ForwardMessages(
+            from_peer=await c.resolve_peer(from_chat),
+            id=ids,
+            random_id=[c.rnd_id() for _ in ids],
+            to_peer=await c.resolve_peer(chat_id),
+            drop_author=True,
+            top_msg_id=top_msg_id
+        )
+    )
+
+
+async def send_uploaded(c, chat_id, media, caption=None, reply_to=None):
+    """Post media previously returned by upload_media() and return the sent Message."""
+    r = await tg_call(
+        c.invoke,
+        raw.functions.messages.SendMedia(
+            peer=await c.resolve_peer(chat_id),
+            media=media,
+            reply_to_msg_id=reply_to,
+            random_id=c.rnd_id(),
+            **await parse_text_entities(c, caption or '', None, None)
+        )
+    )
+    for i in r.updates:
+        if isinstance(i, (raw.types.UpdateNewMessage, raw.types.UpdateNewChannelMessage)):
+            return await types.Message._parse(
+                c, i.message,
+                {u.id: u for u in r.users},
+                {ch.id: ch for ch in r.chats}
+            )
+    return None